@@ -9,6 +9,13 @@ from _api import (
     Dispatcher, 
     Handler, 
     token, 
+    cleartokens, 
+    tokenstats, 
+    RunContext, 
+    RunRegistry, 
+    walk, 
+    PREORDER, 
+    POSTORDER, 
 )
 from metaconfigure import (
     registerTransform,
@@ -1,34 +1,61 @@
+import copy
 import types
 import sys
+import weakref
+import threading
 import traceback
+import Queue
+from functools import partial
+from contextlib import contextmanager
+from multiprocessing.pool import ThreadPool
 
-from odict import odict
 from node.interfaces import IRoot
-from zope.interface import implementer
+from zope.interface import (
+    implementer,
+    providedBy,
+)
+from zope.interface.interface import Specification
 from zope.component import (
+    getSiteManager,
     getUtility,
-    queryUtility,
-    getUtilitiesFor,
-    provideUtility,
 )
 from zope.component.interfaces import ComponentLookupError
+from zope.interface.registry import Components
 from agx.core.interfaces import (
     IConfLoader,
     IController,
     IProcessor,
     ITransform,
+    IStreamingTransform,
     IGenerator,
     ITargetHandler,
     IDispatcher,
     IHandler,
     IScope,
     IToken,
+    ILazyTarget,
 )
+from agx.core.planner import Plan
 from agx.core.util import (
+    UUIDMAPPING,
+    uuidindex,
     readsourcepath,
     writesourcepath,
     write_source_to_target_mapping,
 )
+from agx.core.stream import SourceStream
+from agx.core.shard import (
+    forkmap,
+    nodeids,
+    newsubtrees,
+    graft,
+    snapshot,
+    delta,
+    merge,
+)
+
+
+_marker = object()
 
 
 @implementer(IController)
@@ -36,21 +63,81 @@ class Controller(object):
     """AGX standalone main controller.
     """
 
+    def __init__(self, jobs=1, fingerprints=None, tokenscope='run',
+                 committer=None, isolated=False, processes=1):
+        """@param jobs: Number of generators executed concurrently in threads,
+                     see ``Processor``.
+        @param fingerprints: ``agx.core.incremental.Fingerprints`` instance.
+                             If given, dispatching is skipped for source
+                             subtrees unchanged since the last run, for
+                             transforms with ``incremental`` set only.
+        @param tokenscope: Lifetime of tokens. Either 'run', tokens are
+                           discarded after the run, or 'transform', tokens
+                           are discarded after each transform. With
+                           'transform', tokens are not available when the
+                           target gets written.
+        @param committer: Callable getting passed the target tree, i.e.
+                          ``agx.core.commit.Committer``. If given, it is used
+                          to write the target instead of calling the target.
+        @param isolated: Flag whether to run with a ``RunRegistry``, so
+                         controllers can run concurrently in threads.
+        @param processes: Number of worker processes used by shardable
+                          generators.
+        """
+        if tokenscope not in ('run', 'transform'):
+            raise ValueError(u"Invalid token scope '%s'." % tokenscope)
+        self.jobs = jobs
+        self.fingerprints = fingerprints
+        self.tokenscope = tokenscope
+        self.committer = committer
+        self.isolated = isolated
+        self.processes = processes
+
     def __call__(self, sourcepath, targetpath):
         confloader = getUtility(IConfLoader) 
         confloader()
         source = None
         target = None
-        for name in confloader.transforms:
-            transform = getUtility(ITransform, name=name)
-            source = transform.source(sourcepath)
-            if source is None:
-                # case continuation, expects None from transform.source
-                source = target
-            target = transform.target(targetpath)
-            processor = Processor(name)
-            target = processor(source, target)
-        target()
+        registry = None
+        if self.isolated:
+            registry = RunRegistry()
+        with RunContext(registry=registry) as context:
+            for name in confloader.transforms:
+                transform = context.registry.getUtility(ITransform, name=name)
+                # pruning is only valid if the target persists between runs
+                incremental = self.fingerprints is not None \
+                    and getattr(transform, 'incremental', False)
+                # fingerprints need the complete source before dispatching
+                if IStreamingTransform.providedBy(transform) \
+                  and not incremental:
+                    source = SourceStream(transform.stream(sourcepath))
+                else:
+                    source = transform.source(sourcepath)
+                if source is None:
+                    # case continuation, expects None from transform.source
+                    source = target
+                target = transform.target(targetpath)
+                prune = None
+                if incremental:
+                    prune = self.fingerprints.update(name, source)
+                processor = Processor(name, jobs=self.jobs, prune=prune,
+                                      processes=self.processes)
+                # the mapping is recorded while the tokens are available
+                if self.tokenscope == 'transform':
+                    with RunContext(name):
+                        target = processor(source, target)
+                        if incremental:
+                            self.fingerprints.record(name)
+                else:
+                    target = processor(source, target)
+                    if incremental:
+                        self.fingerprints.record(name)
+            if self.committer is not None:
+                self.committer(target)
+            else:
+                target()
+            if self.fingerprints is not None:
+                self.fingerprints.save()
         return target
 
 
@@ -59,103 +146,316 @@ class Processor(object):
     """Default processor.
     """
 
-    def __init__(self, transform):
+    def __init__(self, transform, jobs=1, prune=None, processes=1):
         """@param transform: The transform name
+        @param jobs: Number of generators executed concurrently. Independent
+                     generators are executed in a thread pool if > 1. Threads
+                     share the GIL, so this only helps generators waiting
+                     for I/O, pure Python handlers do not run in parallel.
+                     Conflicting writes of concurrent generators to the
+                     target tree are detected, see ``WriteJournal``.
+        @param prune: Optional callable getting passed each source node.
+                      Source subtrees it returns ``True`` for are not
+                      dispatched.
+        @param processes: Number of worker processes used by shardable
+                          generators.
         """
         self.transform = transform
+        self.jobs = jobs
+        self.prune = prune
+        self.processes = processes
 
     def __call__(self, source, target):
+        """@param source: Source root or ``SourceStream``.
+        @param target: Target root.
+        """
         generators = self.lookup_generators()
+        done = set()
         targethandler = None
-        for generator in generators:
-            targethandler = getUtility(ITargetHandler, name=generator.name)
-            targethandler.anchor = None
-            targethandler.__init__(target)
-            generator(source, targethandler)
-        if targethandler is None:
-            # no generators registered:
-            return target
+        if isinstance(source, SourceStream):
+            stream = source
+            streaming = list()
+            for generator in generators:
+                if not generator.streamable:
+                    break
+                streaming.append(generator)
+            try:
+                if streaming:
+                    targethandler = self._execute_streaming(streaming, stream,
+                                                            target)
+                source = stream.materialize()
+            finally:
+                stream.close()
+            generators = generators[len(streaming):]
+            done.update([generator.name for generator in streaming])
+        if not generators:
+            if targethandler is None:
+                return target
+            return targethandler.anchor.root
+        if self.jobs > 1 and len(generators) > 1:
+            targethandler = self._execute_parallel(generators, source, target,
+                                                   done)
+        else:
+            for generator in generators:
+                targethandler = self._execute(generator, source, target)
         return targethandler.anchor.root
 
-    def lookup_generators(self):
-        generators = list()
-        for genname, generator in getUtilitiesFor(IGenerator):
-            transformname = genname[:genname.find('.')]
-            if transformname == self.transform:
-                generators.append(generator)
-        generators = self._sortgenerators(generators)
-        return generators
-
-    def _sortgenerators_j(self, generators):
-        # jensens flavor of a valid dependency chain sorter
-        # it breaks the test, nevertheless its output is valid
-        lookup = odict([(g.name[g.name.find('.')+1:], g) for g in generators])
-        inkeys = lookup.keys()
-        outkeys = ['NO']
-        while len(inkeys) != 0:
-            iterkeys = [k for k in inkeys]
-            for inkey in iterkeys:
-                if lookup[inkey].depends not in outkeys:
-                    continue
-                outkeys.insert(outkeys.index(lookup[inkey].depends)+1, inkey)
-                inkeys.remove(inkey)
-            if len(iterkeys) == len(inkeys):
-                raise ValueError, 'Broken dependency chain.'
-        return [lookup[key] for key in outkeys[1:]]
-
-    def _sortgenerators_r(self, generators):
-        dtree = {'NO': ([], {})}
-        self._makedtree(generators, dtree)
-        sortedgen = list()
-        self._fillsorted(sortedgen, dtree)
-        return sortedgen
-
-    _sortgenerators = _sortgenerators_r
-
-    def _fillsorted(self, sortedgen, dtree):
-        """Flatten dependency tree.
+    def _targethandler(self, generator, target, journal=None):
+        targethandler = currentregistry().getUtility(ITargetHandler,
+                                                     name=generator.name)
+        targethandler.anchor = None
+        targethandler.__init__(target)
+        if journal is not None:
+            targethandler.journal = partial(journal.record, generator.name)
+        generator.prune = self.prune
+        generator.processes = self.processes
+        generator.journal = journal
+        return targethandler
+
+    def _reset(self, generator, targethandler):
+        targethandler.journal = None
+        generator.journal = None
+        generator.prune = None
+        generator.processes = 1
+
+    def _execute(self, generator, source, target, journal=None):
+        targethandler = self._targethandler(generator, target, journal)
+        try:
+            generator(source, targethandler)
+        finally:
+            self._reset(generator, targethandler)
+        return targethandler
+
+    def _execute_streaming(self, generators, stream, target):
+        """Execute streamable generators while the source is read.
+
+        Each child of the source root is dispatched by all generators in
+        plan order as soon as it has been read. Thus handlers of these
+        generators must only depend on the subtree they are called for and
+        its ancestors.
         """
-        for key in sorted(dtree.keys()):
-            for gen in dtree[key][0]:
-                sortedgen.append(gen)
-            self._fillsorted(sortedgen, dtree[key][1])
+        source = stream.root
+        targethandlers = list()
+        try:
+            for generator in generators:
+                targethandler = self._targethandler(generator, target)
+                targethandlers.append(targethandler)
+                generator.begin(source, targethandler)
+            for subtree in stream:
+                for generator in generators:
+                    generator.feed(subtree)
+            for generator in generators:
+                generator.end()
+        finally:
+            for generator, targethandler in zip(generators, targethandlers):
+                self._reset(generator, targethandler)
+        return targethandlers[-1]
+
+    def _execute_parallel(self, generators, source, target, done=()):
+        """Execute generators in a thread pool.
+
+        A generator gets scheduled as soon as the generator it depends on has
+        finished. This is concurrency without parallelism, handlers still
+        run one at a time under the GIL.
 
-    def _makedtree(self, generators, dtree):
-        """Sort list of generators by generator.dependency.
+        Target nodes written by generators which might have run
+        concurrently are reported as conflict, see ``WriteJournal``. Changes
+        beneath other existing target nodes than the anchor, attributes
+        changed and changes of shared tokens are not detected.
+
+        @param done: Names of generators already executed.
         """
-        children = list()
-        for generator in generators:
-            if not generator.depends in dtree.keys():
-                children.append(generator)
+        plan = self.plan
+        journal = WriteJournal()
+        finished = Queue.Queue()
+        pending = list(generators)
+        done = set(done)
+        running = 0
+        context = currentcontext()
+
+        def job(generator):
+            try:
+                with bindcontext(context):
+                    self._execute(generator, source, target, journal)
+                finished.put((generator, None))
+            except Exception:
+                finished.put((generator, sys.exc_info()))
+
+        pool = ThreadPool(self.jobs)
+        try:
+            while pending or running:
+                for generator in [gen for gen in pending \
+                                  if done.issuperset(plan.depends[gen.name])]:
+                    pending.remove(generator)
+                    pool.apply_async(job, (generator,))
+                    running += 1
+                if not running:
+                    raise ValueError, 'Broken dependency chain.'
+                generator, exc_info = finished.get()
+                running -= 1
+                if exc_info is not None:
+                    raise exc_info[0], exc_info[1], exc_info[2]
+                done.add(generator.name)
+        finally:
+            pool.close()
+            pool.join()
+        journal.check(plan)
+        return currentregistry().getUtility(ITargetHandler,
+                                            name=generators[-1].name)
+
+    @property
+    def plan(self):
+        """``agx.core.planner.Plan`` for this transform.
+
+        The plan is cached per component registry until it changes.
+        """
+        registry = currentregistry()
+        generation = _registrygeneration()
+        plans = _registrycache(registry, 'plans')
+        cached = plans.get(self.transform)
+        if cached is None or cached[0] != generation:
+            generators = list()
+            for genname, generator in registry.getUtilitiesFor(IGenerator):
+                transformname = genname[:genname.find('.')]
+                if transformname == self.transform:
+                    generators.append(generator)
+            cached = (generation, Plan(self.transform, generators))
+            plans[self.transform] = cached
+        return cached[1]
+
+    def lookup_generators(self):
+        return list(self.plan.generators)
+
+
+
+class WriteJournal(object):
+    """Record target nodes written by concurrently executed generators.
+
+    Nodes passed to ``TreeSyncPreperator.finalize`` are recorded by the
+    target handler, children added to or replaced on the target anchor while
+    dispatching a source node are recorded by ``dispatch``.
+    """
+
+    def __init__(self):
+        self.writes = dict()
+        self._lock = threading.Lock()
+        self._anchorlocks = dict()
+
+    def record(self, generator, node):
+        with self._lock:
+            entry = self.writes.get(id(node))
+            if entry is None:
+                # path is kept, replaced nodes might get detached
+                entry = (node, '/'.join(node.path), list())
+                self.writes[id(node)] = entry
+            if generator not in entry[2]:
+                entry[2].append(generator)
+
+    def dispatch(self, generator, dispatcher, source, targethandler):
+        """Call dispatcher and record children its handlers added to or
+        replaced on the target anchor.
+
+        Dispatching on the same anchor is serialized, so children get
+        recorded for the generator which actually added them. Replaced
+        children are recorded as written as well.
+
+        @param generator: Name of the dispatching generator.
+        """
+        anchor = targethandler.anchor
+        if anchor is None:
+            dispatcher(source, targethandler)
+            return
+        with self._anchorlock(anchor):
+            before = self._children(anchor)
+            dispatcher(source, targethandler)
+            after = self._children(anchor)
+        for key, node in after.items():
+            previous = before.get(key)
+            if previous is node:
                 continue
-            genname = generator.name[generator.name.find('.') + 1:]
-            if dtree[generator.depends][1].get(genname, None) is None:
-                dtree[generator.depends][1][genname] = ([], {})
-            for gen in dtree[generator.depends][0]:
-                if gen.name == generator.name:
-                    continue
-            dtree[generator.depends][0].append(generator)
-                
-        for child in dtree.values():
-            self._makedtree(children, child[1])
+            if previous is not None:
+                self.record(generator, previous)
+            self.record(generator, node)
 
-    def _printdtree(self, dtree, indent=0):
-        """Debug function.
+    def _anchorlock(self, anchor):
+        with self._lock:
+            return self._anchorlocks.setdefault(id(anchor), threading.RLock())
+
+    def _children(self, node):
+        # lazy nodes not loaded have not been written, do not load them
+        if ILazyTarget.providedBy(node) and not node.loaded:
+            return dict()
+        return dict(node.items())
+
+    def check(self, plan):
+        """Raise ``ValueError`` if target nodes have been written by
+        generators not depending on each other.
+
+        @param plan: ``agx.core.planner.Plan`` of the executed generators.
         """
-        keys = dtree.keys()
-        keys.sort()
-        for key in keys:
-            if dtree[key][1].keys():
-                print indent * ' ' + '%s dependencies:' % key
-            for gen in dtree[key][0]:
-                print (indent) * ' ' + ' - %s' % gen.name
-            self._printdtree(dtree[key][1], indent + 4)
+        requires = plan.requires
+        conflicts = list()
+        for node, path, writers in self.writes.values():
+            for i, name in enumerate(writers):
+                for other in writers[i + 1:]:
+                    if requires(name, other) or requires(other, name):
+                        continue
+                    pair = sorted([name, other])
+                    conflicts.append(u"'%s' written by '%s' and '%s'" % (
+                        path, pair[0], pair[1]))
+        if conflicts:
+            conflicts.sort()
+            raise ValueError(u"Conflicting writes to target: %s" % \
+                             u', '.join(conflicts))
+
+
+PREORDER = 0
+POSTORDER = 1
+
+
+def walk(nodes, prune=None):
+    """Iterate nodes and all their descendants depth first.
+
+    Uses an explicit stack instead of recursion and yields
+    ``(event, node)`` tuples, where event is either ``PREORDER`` or
+    ``POSTORDER``. The children of a node are read after its pre-order event
+    has been consumed, so they might be added while visiting the node.
+
+    If ``prune`` is given, it gets called with each node. Nodes it returns
+    ``True`` for are skipped including their descendants.
+    """
+    stack = [(None, iter(nodes))]
+    while stack:
+        parent, children = stack[-1]
+        for node in children:
+            if prune is not None and prune(node):
+                continue
+            yield PREORDER, node
+            stack.append((node, iter(node.values())))
+            break
+        else:
+            stack.pop()
+            if parent is not None:
+                yield POSTORDER, parent
 
 
 @implementer(IGenerator)
 class Generator(object):
     """Default Generator.
+
+    If ``shardable`` is set and ``processes`` is > 1, the children of the
+    source root are dispatched by forked worker processes, see
+    ``_dispatch_sharded``.
+
+    If ``streamable`` is set, the generator dispatches the children of a
+    streamed source root as they are read, see ``begin``.
     """
+    prune = None
+    journal = None
+    shardable = False
+    streamable = False
+    processes = 1
+    _dispatcher = None
 
     def __init__(self, name, depends, description=u''):
         self.name = name
@@ -166,14 +466,124 @@ class Generator(object):
     def __call__(self, source, target):
         self.source = source
         self.target = target
-        self._dispatch([source])
+        if self.shardable and self.processes > 1:
+            self._dispatch_sharded(source)
+        else:
+            self._dispatch([source])
 
     def _dispatch(self, children):
-        dispatcher = getUtility(IDispatcher, name=self.name)
-        for child in children:
-            self.target(child)
-            dispatcher(child, self.target)
-            self._dispatch([node for name, node in child.items()])
+        dispatcher = currentregistry().getUtility(IDispatcher, name=self.name)
+        previsit = self.previsit
+        postvisit = self.postvisit
+        for event, node in walk(children, self.prune):
+            if event == PREORDER:
+                previsit(node, dispatcher)
+            else:
+                postvisit(node, dispatcher)
+
+    def begin(self, source, target):
+        """Start dispatching a source root whose children are not read yet.
+
+        Children are passed to ``feed`` in order once they are completely
+        read, ``end`` is called when the source has been read.
+        """
+        self.source = source
+        self.target = target
+        self._dispatcher = None
+        if self.prune is not None and self.prune(source):
+            return
+        self._dispatcher = currentregistry().getUtility(IDispatcher,
+                                                        name=self.name)
+        self.previsit(source, self._dispatcher)
+
+    def feed(self, node):
+        """Dispatch a completely read child of the source root.
+        """
+        if self._dispatcher is not None:
+            self._dispatch([node])
+
+    def end(self):
+        """Finish dispatching the source root.
+        """
+        if self._dispatcher is not None:
+            self.postvisit(self.source, self._dispatcher)
+            self._dispatcher = None
+
+    def _dispatch_sharded(self, source):
+        """Dispatch source root, its children in worker processes.
+
+        Each worker dispatches the subtree of one child of the source root.
+        Target subtrees created by the worker and its changes of tokens are
+        merged back in order of the children, changes of target nodes
+        existing before the workers were forked are lost. Token changes are
+        merged as computed by ``agx.core.shard.delta``. Changes of containers
+        nested in token attributes, i.e. appending to a list contained in a
+        dict, can not be merged and fail the shard. Nodes of the created
+        target subtrees must be picklable.
+        """
+        if self.prune is not None and self.prune(source):
+            return
+        dispatcher = currentregistry().getUtility(IDispatcher, name=self.name)
+        self.previsit(source, dispatcher)
+        children = [child for child in source.values() \
+                    if self.prune is None or not self.prune(child)]
+        if len(children) < 2:
+            self._dispatch(children)
+            self.postvisit(source, dispatcher)
+            return
+        targethandler = self.target
+        root = targethandler.target
+        tokens = currenttokens()
+        ids = nodeids(root)
+        base = snapshot(tokens.items())
+        mapped = dict(uuidindex().targets)
+        context = currentcontext()
+
+        def shard(child):
+            # workers might be forked by another thread of the pool
+            with bindcontext(context):
+                # locks of the write journal might have been held by other
+                # threads when forked, grafted subtrees are journaled instead
+                self.journal = targethandler.journal = None
+                self._dispatch([child])
+                mapping = dict([(k, v) for k, v in \
+                                uuidindex().targets.items() \
+                                if mapped.get(k) != v])
+            return (newsubtrees(root, ids),
+                    delta(tokens.items(), base, exclude=[UUIDMAPPING]),
+                    mapping)
+
+        results = forkmap(shard, children, self.processes)
+        for child, (result, error) in zip(children, results):
+            if error is not None:
+                raise ValueError(u"Shard '%s' of generator '%s' failed:\n%s" \
+                                 % (child.__name__, self.name, error))
+        for result, error in results:
+            subtrees, changes, mapping = result
+            for path, key, node in subtrees:
+                for added in graft(targethandler.lookup(path), key, node):
+                    if targethandler.journal is not None:
+                        targethandler.journal(added)
+            merge(changes, lambda name: token(name, True))
+            uuidindex().merge(mapping)
+        self.postvisit(source, dispatcher)
+
+    def previsit(self, node, dispatcher):
+        """Called for each node before its children get visited.
+
+        Syncs the target handler and dispatches the node. If executed
+        concurrently with other generators, writes to the target anchor get
+        recorded by the ``WriteJournal``.
+        """
+        self.target(node)
+        if self.journal is not None:
+            self.journal.dispatch(self.name, dispatcher, node, self.target)
+            return
+        dispatcher(node, self.target)
+
+    def postvisit(self, node, dispatcher):
+        """Called for each node after all its children have been visited.
+        """
 
 
 @implementer(ITargetHandler)
@@ -181,9 +591,12 @@ class TargetHandler(object):
     """Abstract target handler.
     """
     anchor = None
+    journal = None
+    _index = None
 
     def __init__(self, root):
         self.target = root
+        self._index = dict()
         if self.anchor is None:
             self.anchor = root
 
@@ -192,18 +605,61 @@ class TargetHandler(object):
                                    "implement ``__call__``.")
 
     def setanchor(self, path):
+        self.anchor = self.lookup(path)
+
+    def lookup(self, path):
+        """Return target node by absolute path.
+
+        Resolved nodes are kept in a path index. Indexed nodes are checked to
+        still be contained in the target tree, so lookup is O(depth).
+
+        @param path: list representing the absolute node path.
+        @raise KeyError: if target node does not exist.
+        """
+        if self._index is None:
+            self._index = dict()
+        key = tuple(path)
+        node = self._index.get(key)
+        if node is not None and self._contained(node, key):
+            return node
+        if not key or key[0] != self.target.__name__:
+            raise KeyError(u"Target node does not exist.")
         node = self.target
-        self._setanchor([node], path)
-
-    def _setanchor(self, children, path):
-        name = path[0]
-        for child in children:
-            if name == child.__name__:
-                if len(path) > 1:
-                    self._setanchor(child.values(), path[1:])
-                else:
-                    self.anchor = child
-                return
+        for name in key[1:]:
+            node = self._child(node, name)
+        self._index[key] = node
+        return node
+
+    def _addindex(self, node):
+        """Add target node to path index.
+        """
+        if self._index is None:
+            self._index = dict()
+        self._index[tuple(node.path)] = node
+
+    def _contained(self, node, key):
+        for name in reversed(key[1:]):
+            parent = node.__parent__
+            if parent is None or self._child(parent, name, None) is not node:
+                return False
+            node = parent
+        return node is self.target
+
+    def _child(self, node, name, default=_marker):
+        try:
+            child = node[name]
+            if child.__name__ == name:
+                return child
+        except (KeyError, TypeError):
+            pass
+        # only containers flagged to have keys differing from child names
+        # are scanned, so a miss is O(1) for all others
+        if getattr(node, 'keysdiffer', False):
+            for child in node.values():
+                if child.__name__ == name:
+                    return child
+        if default is not _marker:
+            return default
         raise KeyError(u"Target node does not exist.")
 
 
@@ -222,15 +678,19 @@ class TreeSyncPreperator(TargetHandler):
     """
 
     def __call__(self, source):
-        if len(source.path) <= len(readsourcepath(self.anchor)):
+        depth = len(source.path)
+        if depth <= len(readsourcepath(self.anchor)):
             elem = self.anchor
-            while len(readsourcepath(elem)) >= len(source.path):
+            while len(readsourcepath(elem)) >= depth:
                 elem = elem.__parent__
             self.anchor = elem
 
     def finalize(self, source, target, set_anchor=True):
+        if self.journal is not None:
+            self.journal(target)
         writesourcepath(source, target)
         write_source_to_target_mapping(source, target)
+        self._addindex(target)
         if set_anchor:
             self.anchor = target
 
@@ -238,61 +698,230 @@ class TreeSyncPreperator(TargetHandler):
 @implementer(IScope)
 class Scope(object):
     """Scope mapping against interfaces.
+
+    A node is in scope if it provides any of ``interfaces``, all of
+    ``require`` and none of ``exclude``, and if ``predicate`` returns
+    ``True`` for it.
     """
 
-    def __init__(self, name, interfaces):
+    def __init__(self, name, interfaces, require=None, exclude=None,
+                 predicate=None):
+        """@param name: Scope name.
+        @param interfaces: Interface or list of interfaces. Node must provide
+                           any of them. Might be empty if ``require`` is
+                           given.
+        @param require: List of interfaces the node must provide all of.
+        @param exclude: List of interfaces the node must not provide.
+        @param predicate: Optional callable getting passed the node.
+        """
+        if interfaces is None:
+            interfaces = []
         if not type(interfaces) == types.ListType:
             interfaces = [interfaces]
         self.name = name
         self.interfaces = interfaces
+        self.require = list(require or [])
+        self.exclude = list(exclude or [])
+        self.predicate = predicate
 
     def __call__(self, node):
-        for iface in self.interfaces:
-            if iface is None:
-                raise ValueError('The Scope "%s" contains a None-Interface' % (self.name))
-            if iface.providedBy(node):
-                return True
-        return False
+        if not self.applies(providedBy(node)):
+            return False
+        return self.predicate is None or bool(self.predicate(node))
+
+    def applies(self, spec):
+        """Check whether scope applies on given interface specification.
+
+        ``predicate`` is not considered.
+        """
+        if self.interfaces or not self.require:
+            for iface in self.interfaces:
+                self._check(iface)
+                if spec.isOrExtends(iface):
+                    break
+            else:
+                return False
+        for iface in self.require:
+            self._check(iface)
+            if not spec.isOrExtends(iface):
+                return False
+        for iface in self.exclude:
+            self._check(iface)
+            if spec.isOrExtends(iface):
+                return False
+        return True
+
+    def _check(self, iface):
+        if iface is None:
+            raise ValueError('The Scope "%s" contains a None-Interface' % (self.name))
+
+    @property
+    def static(self):
+        """Flag whether the result can be computed by ``applies`` per
+        interface specification and checking ``predicate`` per node.
+
+        This is not the case for subclasses overriding ``__call__``.
+        """
+        return type(self).__call__.im_func is Scope.__call__.im_func
+
+
+def _registrygeneration():
+    """Return the change counter of the current utility registry.
+
+    Used to invalidate cached lookups whenever registrations change.
+    """
+    return currentregistry().utilities._generation
+
+
+_registrycaches = weakref.WeakKeyDictionary()
+
+
+def _registrycache(registry, name):
+    """Return dict for caching lookups made on registry.
+    """
+    caches = _registrycaches.get(registry)
+    if caches is None:
+        caches = _registrycaches.setdefault(registry, dict())
+    return caches.setdefault(name, dict())
+
+
+class HandlerIndex(object):
+    """Namespace index of registered handlers.
+
+    Maps transform name to generator name to the list of handlers registered
+    for this generator, ordered by execution order. Handlers of generators
+    not registered are not contained. The index is kept per component
+    registry and rebuilt when the registry changes.
+    """
+
+    def __call__(self, transform, generator):
+        registry = currentregistry()
+        generation = _registrygeneration()
+        cache = _registrycache(registry, 'handlerindex')
+        if cache.get('generation') != generation:
+            cache['index'] = self._build(registry)
+            cache['generation'] = generation
+        return cache['index'].get(transform, {}).get(generator, [])
+
+    def _build(self, registry):
+        # handler names might contain dots, so they are bucketed by the
+        # registered generator names instead of splitting them. longest
+        # names first in case generator names are prefixes of each other.
+        gennames = [name for name, generator in \
+                    registry.getUtilitiesFor(IGenerator)]
+        gennames.sort(key=len, reverse=True)
+        index = dict()
+        for name, handler in registry.getUtilitiesFor(IHandler):
+            for genname in gennames:
+                if handler.name.startswith(genname + '.'):
+                    break
+            else:
+                continue
+            transform = genname[:genname.find('.')]
+            generator = genname[len(transform) + 1:]
+            generators = index.setdefault(transform, dict())
+            generators.setdefault(generator, list()).append(handler)
+        for generators in index.values():
+            for generator, handlers in generators.items():
+                generators[generator] = self._order(handlers)
+        return index
+
+    def _order(self, handlers):
+        # handlers with defined order first, followed by the unordered ones.
+        # sort by name first to get a stable result for equal orders.
+        handlers = sorted(handlers, key=lambda x: x.name)
+        ordered = [handler for handler in handlers if handler.order > -1]
+        ordered.sort(key=lambda x: x.order)
+        unordered = [handler for handler in handlers if handler.order == -1]
+        return ordered + unordered
+
+
+handlerindex = HandlerIndex()
 
 
 @implementer(IDispatcher)
 class Dispatcher(object):
     """Default dispatcher.
+
+    The dispatch table containing the ordered handlers and their resolved
+    scopes is computed once and kept until the component registry changes.
+
+    Static scopes are evaluated once per distinct interface specification
+    provided by source nodes, the resulting handler list is cached. Only
+    predicates of static scopes are called per node.
     """
 
     def __init__(self, generator):
         self.generator = self.name = generator
         self.transform = generator[:generator.find('.')]
+        self._table = None
+        self._generation = None
+        self._specs = dict()
 
     def __call__(self, source, targethandler):
-        handlers = self.lookup_handlers()
-        for handler in handlers:
+        for handler, scope in self.applicable(source):
+            if scope is not None and not scope(source):
+                continue
+            handler(source, targethandler)
+
+    def __copy__(self):
+        # caches are not shared with copies made by ``RunRegistry``
+        return self.__class__(self.generator)
+
+    def applicable(self, source):
+        """List of ``(handler, scope)`` tuples applicable for source.
+
+        ``scope`` is ``None`` if it has been checked already, otherwise it
+        is a callable which must be checked against the source node by the
+        caller, i.e. the scope itself or its predicate.
+        """
+        table = self.table
+        spec = providedBy(source)
+        entries = self._specs.get(spec)
+        if entries is None:
+            entries = list()
+            for handler, scope in table:
+                if scope is not None and getattr(scope, 'static', False):
+                    if not scope.applies(spec):
+                        continue
+                    # remaining per node check, if any
+                    scope = getattr(scope, 'predicate', None)
+                entries.append((handler, scope))
+            self._specs[spec] = entries
+        return entries
+
+    @property
+    def table(self):
+        """List of ``(handler, scope)`` tuples in execution order.
+
+        ``scope`` is ``None`` for handlers without scope.
+        """
+        generation = _registrygeneration()
+        if self._table is None or generation != self._generation:
+            self._table = self._buildtable()
+            self._specs = dict()
+            # building the table might register utilities on its own
+            self._generation = _registrygeneration()
+        return self._table
+
+    def _buildtable(self):
+        table = list()
+        for handler in self.lookup_handlers():
+            scope = None
             if handler.scope:
                 scopename = '%s.%s' % (self.transform, handler.scope)
-                scope = queryUtility(IScope, name=scopename)
+                scope = currentregistry().queryUtility(IScope, name=scopename)
                 if scope is None:
-                    func=handler._callfunc
-                    dottedpack=func.func_globals['__package__']
+                    func = handler._callfunc
+                    dottedpack = func.func_globals['__package__']
                     print >> sys.stderr, ValueError('No Scope defined with name %s for handler %s, defined in %s' % (scopename, func.__name__, dottedpack))
                     continue
-                if not scope(source):
-                    continue
-                
-            handler(source, targethandler)
+            table.append((handler, scope))
+        return table
 
     def lookup_handlers(self):
-        handlers = getUtilitiesFor(IHandler)
-        handlers = [util for name, util in handlers]
-        unordered = list()
-        for handler in handlers:
-            if handler.order == -1:
-                unordered.append(handler)
-        handlers = [handler for handler in handlers if handler.order > -1]
-        handlers.sort(lambda x, y: x.order < y.order and -1 or 1)
-        handlers = handlers + unordered
-        handlers = [handler for handler in handlers \
-                    if handler.name.startswith(self.name)]
-        return handlers
+        generator = self.name[len(self.transform) + 1:]
+        return list(handlerindex(self.transform, generator))
 
 
 @implementer(IHandler)
@@ -335,26 +964,258 @@ class Handler(object):
             
 
 
+class TokenStore(object):
+    """Store for tokens.
+
+    Maps token names to tokens. Generators might run concurrently, see
+    ``Processor``, so creation of tokens is locked.
+    """
+
+    def __init__(self):
+        self.tokens = dict()
+        self.lock = threading.Lock()
+
+    def get(self, name):
+        return self.tokens.get(name)
+
+    def create(self, name, kw):
+        """Return existing token or create a new one.
+
+        @param name: Token name.
+        @param kw: dict of token attributes used if token gets created.
+        @return: Tuple ``(token, created)``.
+        """
+        with self.lock:
+            token = self.tokens.get(name)
+            if token is not None:
+                return token, False
+            token = self.tokens[name] = Token(**kw)
+            return token, True
+
+    def names(self):
+        return sorted(self.tokens.keys())
+
+    def items(self):
+        with self.lock:
+            return self.tokens.items()
+
+    def clear(self):
+        with self.lock:
+            self.tokens.clear()
+
+
+tokenstore = TokenStore()
+
+
 def token(name, create, reset=False, **kw):
     """Create or lookup a token by name.
     """
     if type(name) is types.ListType:
         name = '.'.join(name)
     kw['name'] = name
-    try:
-        token = getUtility(IToken, name=name)
-        if reset:
-            token.__init__(**kw)
-        for k in kw:
-            if not hasattr(token, k): setattr(token, k, kw[k])
-    except ComponentLookupError, e:
+    store = currenttokens()
+    token = store.get(name)
+    if token is None:
         if not create:
-            raise e
-        token = Token(**kw)
-        provideUtility(token, provides=IToken, name=name)
+            raise ComponentLookupError(IToken, name)
+        token, created = store.create(name, kw)
+        if created:
+            return token
+    elif reset:
+        token.__init__(**kw)
+    for k in kw:
+        if not hasattr(token, k): setattr(token, k, kw[k])
     return token
 
 
+def cleartokens():
+    """Remove all tokens of the current run context.
+    """
+    currenttokens().clear()
+
+
+def tokenstats():
+    """Return token count and approximate memory usage per namespace.
+
+    The namespace of a token is the first part of its dotted name. Memory
+    usage is the size of the token attributes including contained lists,
+    tuples, sets, dicts and the attributes of contained objects, i.e. of a
+    ``UUIDIndex``. Nodes are accounted to their tree and not traversed,
+    classes, modules, functions and interface specifications are shared and
+    not accounted.
+
+    @return: dict containing ``{namespace: {'count': n, 'size': bytes}}``
+    """
+    stats = dict()
+    for name, token in currenttokens().items():
+        entry = stats.setdefault(name.split('.')[0], {'count': 0, 'size': 0})
+        entry['count'] += 1
+        entry['size'] += _sizeof(token.__dict__, set())
+    return stats
+
+
+# objects not accounted to tokens
+_sizeshared = (type, types.ClassType, types.ModuleType, types.FunctionType,
+               types.MethodType, Specification)
+
+
+def _sizeof(obj, seen):
+    if id(obj) in seen or isinstance(obj, _sizeshared):
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            size += _sizeof(key, seen) + _sizeof(value, seen)
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        for value in obj:
+            size += _sizeof(value, seen)
+    else:
+        attrs = getattr(obj, '__dict__', None)
+        if type(attrs) is dict and '__parent__' not in attrs:
+            size += _sizeof(attrs, seen)
+    return size
+
+
+class RunContext(object):
+    """Scope of tokens and component registry.
+
+    Tokens created while a run context is active are stored in the context
+    and discarded when it is left. Run contexts are bound to the current
+    thread and might be nested, the innermost one is used. Without an active
+    run context, tokens are kept in the global ``tokenstore``.
+
+    If a registry is given, it is used for component lookups by
+    ``Controller``, ``Processor``, ``Generator`` and ``Dispatcher`` while the
+    context is active. Otherwise the registry of the enclosing context or the
+    site manager is used.
+    """
+
+    def __init__(self, name=None, registry=None):
+        self.name = name
+        self.tokens = TokenStore()
+        self._registry = registry
+
+    @property
+    def registry(self):
+        if self._registry is not None:
+            return self._registry
+        return getSiteManager()
+
+    def __enter__(self):
+        outer = currentcontext()
+        if self._registry is None and outer is not None:
+            self._registry = outer._registry
+        _contexts().append(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        _contexts().remove(self)
+        self.tokens.clear()
+
+
+_local = threading.local()
+
+
+def _contexts():
+    contexts = getattr(_local, 'contexts', None)
+    if contexts is None:
+        contexts = _local.contexts = list()
+    return contexts
+
+
+def currentcontext():
+    """Return innermost active ``RunContext`` of this thread or ``None``.
+    """
+    contexts = getattr(_local, 'contexts', None)
+    if contexts:
+        return contexts[-1]
+    return None
+
+
+def currentregistry():
+    """Return component registry of the current run context.
+    """
+    context = currentcontext()
+    if context is None:
+        return getSiteManager()
+    return context.registry
+
+
+class RunRegistry(Components):
+    """Component registry of a single run.
+
+    Inherits all registrations of the base registry, which is supposed to be
+    left unchanged while runs are active. Generators, target handlers and
+    dispatchers carry run state, lookups of them return copies owned by this
+    registry. Components registered at this registry are only visible to
+    the run.
+    """
+    stateful = (IGenerator, ITargetHandler, IDispatcher)
+
+    def __init__(self, base=None):
+        if base is None:
+            base = getSiteManager()
+        Components.__init__(self, 'run', bases=(base,))
+        self._copies = dict()
+        self._copylock = threading.Lock()
+
+    def _copy(self, provided, name, component):
+        key = (provided, name)
+        clone = self._copies.get(key)
+        if clone is None:
+            with self._copylock:
+                clone = self._copies.get(key)
+                if clone is None:
+                    clone = self._copies[key] = copy.copy(component)
+        return clone
+
+    def queryUtility(self, provided, name=u'', default=None):
+        component = Components.queryUtility(self, provided, name, _marker)
+        if component is _marker:
+            return default
+        if provided in self.stateful:
+            return self._copy(provided, name, component)
+        return component
+
+    def getUtility(self, provided, name=u''):
+        component = self.queryUtility(provided, name, _marker)
+        if component is _marker:
+            raise ComponentLookupError(provided, name)
+        return component
+
+    def getUtilitiesFor(self, interface):
+        for name, component in Components.getUtilitiesFor(self, interface):
+            if interface in self.stateful:
+                component = self._copy(interface, name, component)
+            yield name, component
+
+
+def currenttokens():
+    """Return ``TokenStore`` of the current run context.
+    """
+    context = currentcontext()
+    if context is not None:
+        return context.tokens
+    return tokenstore
+
+
+@contextmanager
+def bindcontext(context):
+    """Activate run context in another thread without discarding its tokens
+    when leaving.
+    """
+    if context is None:
+        yield
+        return
+    contexts = _contexts()
+    contexts.append(context)
+    try:
+        yield
+    finally:
+        contexts.remove(context)
+
+
 @implementer(IToken)
 class Token(object):
     """A token.
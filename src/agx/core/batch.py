@@ -0,0 +1,122 @@
+import os
+import traceback
+from timeit import default_timer
+from zope.component import queryUtility
+from agx.core.interfaces import IConfLoader
+from agx.core import (
+    Controller,
+    cleartokens,
+)
+from agx.core.shard import forkmap
+
+
+class BatchResult(object):
+    """Result of a single batch item.
+    """
+
+    def __init__(self, item, seconds, error=None):
+        self.item = item
+        self.seconds = seconds
+        self.error = error
+
+    @property
+    def failed(self):
+        return self.error is not None
+
+    def __repr__(self):
+        return '<%s %r %s>' % (self.__class__.__name__, self.item,
+                               self.failed and 'failed' or 'ok')
+
+
+def read_batchfile(path):
+    """Read model paths from file.
+
+    One path per line, empty lines and lines starting with ``#`` are ignored.
+    Relative paths are relative to the directory containing the file.
+    """
+    basedir = os.path.dirname(os.path.abspath(path))
+    ret = list()
+    with open(path) as file:
+        for line in file:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            ret.append(os.path.join(basedir, line))
+    return ret
+
+
+def warmup():
+    """Load the configuration, so it is shared by all batch items and
+    inherited by forked worker processes.
+    """
+    confloader = queryUtility(IConfLoader)
+    if confloader is not None:
+        confloader()
+
+
+def _timed(func):
+    """Return callable calling func with an item and returning its wall time
+    and the formatted traceback if it failed. Tokens are cleared afterwards.
+    """
+    def call(item):
+        start = default_timer()
+        error = None
+        try:
+            func(item)
+        except Exception:
+            error = traceback.format_exc()
+        finally:
+            cleartokens()
+        return default_timer() - start, error
+    return call
+
+
+def batch(items, func, processes=1):
+    """Call func for each item in one warm process.
+
+    The configuration gets loaded once before the first item, tokens are
+    cleared after each item. Failing items do not abort the batch.
+
+    @param items: List of items, i.e. model paths.
+    @param func: Callable getting passed an item.
+    @param processes: If > 1, items are processed by a pool of worker
+                      processes forked after the configuration has been
+                      loaded.
+    @return: List of ``BatchResult`` in order of items.
+    """
+    items = list(items)
+    warmup()
+    call = _timed(func)
+    if processes > 1 and len(items) > 1:
+        # workers are reused, tokens are cleared after each item
+        raw = [result or (0.0, error) for result, error in \
+               forkmap(call, items, processes, fresh=False)]
+    else:
+        raw = [call(item) for item in items]
+    return [BatchResult(item, seconds, error) \
+            for item, (seconds, error) in zip(items, raw)]
+
+
+def generate(pairs, processes=1, **kw):
+    """Run ``Controller`` for many ``(sourcepath, targetpath)`` pairs.
+
+    @param pairs: List of ``(sourcepath, targetpath)`` tuples.
+    @param processes: Number of worker processes.
+    @param kw: Keyword arguments passed to ``Controller``.
+    @return: List of ``BatchResult``.
+    """
+    controller = Controller(**kw)
+    return batch(pairs, lambda pair: controller(*pair), processes)
+
+
+def summary(results):
+    """Return timing summary of batch results as text, slowest first.
+    """
+    lines = ['%10s  %-6s %s' % ('seconds', 'status', 'item')]
+    for result in sorted(results, key=lambda x: -x.seconds):
+        lines.append('%10.2f  %-6s %s' % (
+            result.seconds, result.failed and 'FAILED' or 'ok', result.item))
+    failed = len([result for result in results if result.failed])
+    lines.append('%10.2f  %d items, %d failed' % (
+        sum([result.seconds for result in results]), len(results), failed))
+    return '\n'.join(lines)
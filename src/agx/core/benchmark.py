@@ -0,0 +1,286 @@
+"""Benchmarks for the agx.core hot paths.
+
+Usage::
+
+    python -m agx.core.benchmark run [-s 1000,10000] [-o results.json]
+    python -m agx.core.benchmark compare baseline.json results.json [-t 0.2]
+    python -m agx.core.benchmark memory [-s 1000,10000]
+"""
+import gc
+import sys
+import json
+import types
+import platform
+from optparse import OptionParser
+from timeit import default_timer
+from zope.component import getUtility
+from zope.interface.interface import Specification
+from agx.core.interfaces import IDispatcher
+from agx.core import (
+    Controller,
+    Processor,
+    TargetHandler,
+    token,
+)
+from agx.core._api import currentregistry
+from agx.core.compact import CompactNode
+from agx.core.testing import fixtures
+
+
+DEFAULT_SIZES = [100, 1000, 10000]
+
+
+def timed(func, repeat=3, setup=None):
+    """Return best wall time of ``repeat`` calls of func.
+
+    @param setup: Optional callable called untimed before each call.
+    """
+    best = None
+    for i in range(repeat):
+        if setup is not None:
+            setup()
+        start = default_timer()
+        func()
+        elapsed = default_timer() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def coldcaches():
+    """Invalidate lookups cached per registry, i.e. plans, the handler index
+    and dispatch tables, as if the registry just changed.
+    """
+    currentregistry().utilities.changed(None)
+
+
+def bench_controller(size, repeat=3):
+    """Full generation run on a model with ``size`` nodes.
+    """
+    name = 'controller%d' % size
+    transform = fixtures.register(name, generators=5, handlers=10)
+    try:
+        transform.source_tree = fixtures.model(size)
+        transform.target_tree = fixtures.TargetNode('root')
+        controller = Controller()
+        return timed(lambda: controller(None, None), repeat, coldcaches)
+    finally:
+        fixtures.unregister(name)
+
+
+def bench_lookup_generators(size, repeat=3):
+    """Lookup and sort ``size`` generators of a transform.
+    """
+    name = 'generators%d' % size
+    fixtures.register(name, generators=size, handlers=0)
+    try:
+        processor = Processor(name)
+        return timed(processor.lookup_generators, repeat, coldcaches)
+    finally:
+        fixtures.unregister(name)
+
+
+def bench_lookup_handlers(size, repeat=3):
+    """Lookup ``size`` handlers of a generator.
+    """
+    name = 'handlers%d' % size
+    fixtures.register(name, generators=1, handlers=size)
+    try:
+        dispatcher = getUtility(IDispatcher, name='%s.generator0' % name)
+        return timed(dispatcher.lookup_handlers, repeat, coldcaches)
+    finally:
+        fixtures.unregister(name)
+
+
+def bench_setanchor(size, repeat=3):
+    """Set anchor to each node of a target tree with ``size`` nodes.
+    """
+    target = fixtures.model(size, factory=fixtures.TargetNode)
+    paths = [node.path for node in _nodes(target)]
+    targethandler = TargetHandler(target)
+
+    def run():
+        for path in paths:
+            targethandler.setanchor(path)
+    return timed(run, repeat)
+
+
+def bench_token(size, repeat=3):
+    """Create and lookup ``size`` tokens.
+    """
+    names = ['benchmark.token%d' % i for i in range(size)]
+
+    def run():
+        for name in names:
+            token(name, True, value=None)
+        for name in names:
+            token(name, False)
+    return timed(run, repeat)
+
+
+def _nodes(root):
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        yield node
+        stack.extend(node.values())
+
+
+BENCHMARKS = [
+    ('controller', bench_controller),
+    ('lookup_generators', bench_lookup_generators),
+    ('lookup_handlers', bench_lookup_handlers),
+    ('setanchor', bench_setanchor),
+    ('token', bench_token),
+]
+
+
+def run(sizes=DEFAULT_SIZES, repeat=3, names=None):
+    """Run benchmarks.
+
+    @param sizes: List of sizes each benchmark is run with.
+    @param repeat: Number of runs, the best time is taken.
+    @param names: Names of benchmarks to run, defaults to all.
+    @return: dict containing environment information and results as
+             ``{benchmark: {size: seconds}}``.
+    """
+    results = dict()
+    for name, bench in BENCHMARKS:
+        if names is not None and name not in names:
+            continue
+        results[name] = dict()
+        for size in sizes:
+            results[name][str(size)] = bench(size, repeat)
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results,
+    }
+
+
+# objects shared between nodes, not accounted to a tree
+_shared = (type, types.ClassType, types.ModuleType, types.FunctionType,
+           Specification)
+
+
+def deepsize(root):
+    """Return approximate memory usage of object and all objects it refers
+    to in bytes.
+
+    Classes, modules, functions and interface specifications are considered
+    shared and not accounted.
+    """
+    seen = set()
+    size = 0
+    stack = [root]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        if isinstance(obj, _shared):
+            continue
+        size += sys.getsizeof(obj)
+        stack.extend(gc.get_referents(obj))
+    return size
+
+
+MEMORY_FACTORIES = [
+    ('mock', fixtures.SourceMock),
+    ('compact', CompactNode),
+]
+
+
+def memory(sizes=DEFAULT_SIZES):
+    """Measure memory usage of synthetic source trees per node factory.
+
+    @param sizes: List of tree sizes.
+    @return: dict containing ``{factory: {size: bytes}}``.
+    """
+    results = dict()
+    for name, factory in MEMORY_FACTORIES:
+        results[name] = dict()
+        for size in sizes:
+            root = fixtures.model(size, factory=factory)
+            results[name][str(size)] = deepsize(root)
+    return results
+
+
+def compare(baseline, current, threshold=0.2):
+    """Compare benchmark results.
+
+    @param baseline: Results as returned by ``run``.
+    @param current: Results as returned by ``run``.
+    @param threshold: Tolerated slow down as fraction of baseline time.
+    @return: List of ``(benchmark, size, baseline, current)`` tuples for
+             results slower than tolerated.
+    """
+    regressions = list()
+    for name, sizes in sorted(current['results'].items()):
+        basesizes = baseline['results'].get(name, {})
+        for size, seconds in sorted(sizes.items(), key=lambda x: int(x[0])):
+            base = basesizes.get(size)
+            if base is None:
+                continue
+            if seconds > base * (1 + threshold):
+                regressions.append((name, size, base, seconds))
+    return regressions
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    parser = OptionParser(__doc__.strip())
+    parser.add_option("-s", "--sizes", dest="sizes",
+                      default=','.join([str(s) for s in DEFAULT_SIZES]),
+                      help="Comma separated sizes")
+    parser.add_option("-r", "--repeat", dest="repeat", type="int", default=3,
+                      help="Number of runs per benchmark")
+    parser.add_option("-b", "--benchmarks", dest="benchmarks", default='',
+                      help="Comma separated benchmark names")
+    parser.add_option("-o", "--output", dest="output", default=None,
+                      help="Write results as JSON to FILE", metavar="FILE")
+    parser.add_option("-t", "--threshold", dest="threshold", type="float",
+                      default=0.2, help="Tolerated slow down, i.e. 0.2")
+    options, args = parser.parse_args(argv)
+    if not args or args[0] not in ('run', 'compare', 'memory'):
+        parser.print_help()
+        return 2
+    if args[0] == 'run':
+        sizes = [int(size) for size in options.sizes.split(',') if size]
+        names = [name for name in options.benchmarks.split(',') if name]
+        results = run(sizes, options.repeat, names or None)
+        for name, values in sorted(results['results'].items()):
+            for size, seconds in sorted(values.items(),
+                                        key=lambda x: int(x[0])):
+                print '%-20s %10s %12.6f' % (name, size, seconds)
+        if options.output:
+            with open(options.output, 'w') as file:
+                json.dump(results, file, indent=2)
+        return 0
+    if args[0] == 'memory':
+        sizes = [int(size) for size in options.sizes.split(',') if size]
+        results = memory(sizes)
+        for size in sizes:
+            for name, factory in MEMORY_FACTORIES:
+                nbytes = results[name][str(size)]
+                print '%-10s %10d %12d bytes %8d bytes/node' % (
+                    name, size, nbytes, nbytes / size)
+        return 0
+    if len(args) != 3:
+        parser.print_help()
+        return 2
+    baseline = json.load(open(args[1]))
+    current = json.load(open(args[2]))
+    regressions = compare(baseline, current, options.threshold)
+    for name, size, base, seconds in regressions:
+        print 'REGRESSION %-20s %10s %12.6f -> %12.6f (%+.0f%%)' % (
+            name, size, base, seconds, (seconds / base - 1) * 100)
+    if regressions:
+        return 1
+    print 'No regressions.'
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
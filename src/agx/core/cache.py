@@ -0,0 +1,73 @@
+import os
+import tempfile
+import cPickle as pickle
+
+
+def cachedir():
+    """Return directory for persistent caches.
+
+    Defaults to ``~/.cache/agx``, can be changed by setting ``AGX_CACHE_DIR``.
+    Returns ``None`` if ``AGX_NO_CACHE`` is set.
+    """
+    if os.environ.get('AGX_NO_CACHE'):
+        return None
+    path = os.environ.get('AGX_CACHE_DIR')
+    if not path:
+        base = os.environ.get('XDG_CACHE_HOME')
+        if not base:
+            base = os.path.join(os.path.expanduser('~'), '.cache')
+        path = os.path.join(base, 'agx')
+    return path
+
+
+def load(name, key):
+    """Load cached value.
+
+    @param name: Name of the cache file.
+    @param key: Key the value must have been stored with.
+    @return: The cached value or ``None`` if no valid value exists.
+    """
+    directory = cachedir()
+    if directory is None:
+        return None
+    try:
+        with open(os.path.join(directory, name), 'rb') as file:
+            storedkey, value = pickle.load(file)
+    except Exception:
+        # missing, corrupt or refering to no longer importable objects
+        return None
+    if storedkey != key:
+        return None
+    return value
+
+
+def dump(name, key, value):
+    """Store value in cache.
+
+    The cache file is replaced atomically.
+
+    @param name: Name of the cache file.
+    @param key: Key used to validate the value on ``load``.
+    @param value: The value. Must be pickleable.
+    @return: Flag whether value has been stored.
+    """
+    directory = cachedir()
+    if directory is None:
+        return False
+    try:
+        data = pickle.dumps((key, value), pickle.HIGHEST_PROTOCOL)
+    except Exception:
+        return False
+    tmppath = None
+    try:
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        fd, tmppath = tempfile.mkstemp(dir=directory, prefix='.%s' % name)
+        with os.fdopen(fd, 'wb') as file:
+            file.write(data)
+        os.rename(tmppath, os.path.join(directory, name))
+    except (IOError, OSError):
+        if tmppath is not None and os.path.exists(tmppath):
+            os.remove(tmppath)
+        return False
+    return True
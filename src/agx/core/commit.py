@@ -0,0 +1,316 @@
+import os
+import json
+import errno
+import shutil
+import hashlib
+import tempfile
+import logging
+from multiprocessing.pool import ThreadPool
+from agx.core.interfaces import (
+    ILazyTarget,
+    ITargetFile,
+)
+
+
+log = logging.getLogger('agx.core.commit')
+
+
+MANIFEST = '.agx-manifest'
+STAGING = '.agx-staging'
+
+
+def _umask():
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+def digest(data):
+    return hashlib.sha1(data).hexdigest()
+
+
+class CommitResult(object):
+    """Result of a commit.
+
+    Contains lists of absolute paths of created, changed, unchanged and
+    removed files and their size in bytes. Sizes of removed files are their
+    size on disk.
+    """
+
+    def __init__(self):
+        self.created = list()
+        self.changed = list()
+        self.unchanged = list()
+        self.removed = list()
+        self.sizes = dict()
+
+    @property
+    def written(self):
+        return sorted(self.created + self.changed)
+
+    def report(self, basedir=None):
+        """Return text listing created, changed and removed files.
+
+        @param basedir: If given, paths are displayed relative to it.
+        """
+        lines = list()
+        for status, paths in [('created', self.created),
+                              ('changed', self.changed),
+                              ('deleted', self.removed)]:
+            for abspath in paths:
+                path = abspath
+                if basedir is not None:
+                    path = os.path.relpath(abspath, basedir)
+                lines.append('%-8s %10d %s' % (status, self.sizes[abspath],
+                                               path))
+        lines.append('%d created (%d bytes), %d changed (%d bytes), '
+                     '%d unchanged, %d deleted (%d bytes)' % (
+            len(self.created), self._bytes(self.created),
+            len(self.changed), self._bytes(self.changed),
+            len(self.unchanged),
+            len(self.removed), self._bytes(self.removed)))
+        return '\n'.join(lines)
+
+    def _bytes(self, paths):
+        return sum([self.sizes[path] for path in paths])
+
+    def __repr__(self):
+        return '<%s created=%d changed=%d unchanged=%d removed=%d>' % (
+            self.__class__.__name__, len(self.created), len(self.changed),
+            len(self.unchanged), len(self.removed))
+
+
+class Committer(object):
+    """Write the files of a target tree.
+
+    Files are the nodes of the target tree providing or adaptable to
+    ``ITargetFile``. Files whose rendered content equals the content on disk
+    are not touched. Changed files are written by a thread pool to a staging
+    directory and renamed to their destination.
+
+    A manifest of the generated files with their content digest is kept in
+    the base directory. It is used to detect unchanged files without reading
+    them and, if ``prune`` is set, to remove files generated by a previous
+    run which are not generated any longer. Files modified since they were
+    generated are never removed.
+
+    Target trees containing leaf nodes which are neither files nor
+    ``ILazyTarget`` nodes, i.e. trees without any files, are rejected with a
+    ``ValueError``. Their output would be dropped silently otherwise.
+    """
+
+    def __init__(self, basedir, jobs=4, prune=False, dryrun=False):
+        """@param basedir: Directory containing manifest and staging area.
+        @param jobs: Number of files rendered and written concurrently.
+        @param prune: Flag whether to remove stale files.
+        @param dryrun: Flag whether to only compute the result. Nothing is
+                       written or removed.
+        """
+        self.basedir = os.path.abspath(basedir)
+        self.jobs = jobs
+        self.prune = prune
+        self.dryrun = dryrun
+        self.mode = 0666 & ~_umask()
+        self.result = None
+
+    @property
+    def manifestpath(self):
+        return os.path.join(self.basedir, MANIFEST)
+
+    @property
+    def stagingpath(self):
+        return os.path.join(self.basedir, STAGING)
+
+    def __call__(self, root):
+        """Commit files of target tree.
+
+        @param root: Target tree.
+        @return: ``CommitResult`` instance, also set as ``result``.
+        """
+        manifest = self.read_manifest()
+        files, untouched = self._collect(root)
+        if not self.dryrun and not os.path.isdir(self.basedir):
+            os.makedirs(self.basedir)
+        pool = ThreadPool(max(self.jobs, 1))
+        try:
+            entries = pool.map(lambda x: self._commit(x, manifest), files)
+        finally:
+            pool.close()
+            pool.join()
+        result = CommitResult()
+        current = dict()
+        for path, status, size, entry in entries:
+            getattr(result, status).append(path)
+            result.sizes[path] = size
+            current[self._key(path)] = entry
+        for key in sorted(set(manifest) - set(current)):
+            if not self.prune or self._beneath(self._path(key), untouched):
+                # keep track of stale files for later pruning
+                current[key] = manifest[key]
+                continue
+            size = self._remove(key, manifest[key])
+            if size is not None:
+                path = self._path(key)
+                result.removed.append(path)
+                result.sizes[path] = size
+        if not self.dryrun:
+            self.write_manifest(current)
+            shutil.rmtree(self.stagingpath, ignore_errors=True)
+        self.result = result
+        return result
+
+    def files(self, root):
+        """Return ``ITargetFile`` implementations of target tree sorted by
+        path. Children of files and ``ILazyTarget`` nodes not loaded are not
+        traversed.
+
+        Raise ``ValueError`` if the tree contains leaf nodes which can not be
+        committed.
+        """
+        return self._collect(root)[0]
+
+    def _collect(self, root):
+        """Return files and absolute paths of lazy nodes not loaded.
+
+        Files generated by a previous run beneath them are never pruned, the
+        generators did not look at them, i.e. since their source was
+        unchanged. Only files removed from a loaded directory are pruned.
+        """
+        files = list()
+        untouched = list()
+        invalid = list()
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            if ILazyTarget.providedBy(node) and not node.loaded:
+                untouched.append(os.path.abspath(node.abspath))
+                continue
+            targetfile = ITargetFile(node, None)
+            if targetfile is not None:
+                files.append(targetfile)
+                continue
+            children = node.values()
+            # empty lazy directories are valid, i.e. all files were removed
+            if not children and not ILazyTarget.providedBy(node):
+                invalid.append('/'.join(node.path))
+            stack.extend(children)
+        if invalid:
+            raise ValueError(u"Target nodes not providing ITargetFile can not "
+                             u"be committed: %s" % ', '.join(sorted(invalid)))
+        files.sort(key=lambda x: x.abspath)
+        return files, untouched
+
+    def _beneath(self, path, paths):
+        for parent in paths:
+            if path == parent or path.startswith(parent + os.sep):
+                return True
+        return False
+
+    def render(self, targetfile):
+        data = targetfile.render()
+        if isinstance(data, unicode):
+            data = data.encode('utf-8')
+        return data
+
+    def read_manifest(self):
+        """Return dict containing ``{path: [digest, size, mtime]}``.
+        """
+        try:
+            with open(self.manifestpath) as file:
+                return json.load(file)
+        except (IOError, ValueError):
+            return dict()
+
+    def write_manifest(self, manifest):
+        self._write(self.manifestpath, json.dumps(manifest, indent=1,
+                                                  sort_keys=True))
+
+    def _key(self, path):
+        relpath = os.path.relpath(path, self.basedir)
+        if relpath.startswith(os.pardir):
+            return path
+        return relpath
+
+    def _path(self, key):
+        return os.path.join(self.basedir, key)
+
+    def _ondisk(self, path, entry):
+        """Return digest of file on disk or ``None`` if it does not exist.
+
+        If size and mtime match the manifest entry the file is not read.
+        """
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        if entry is not None and entry[1:] == [stat.st_size, stat.st_mtime]:
+            return entry[0]
+        with open(path, 'rb') as file:
+            return digest(file.read())
+
+    def _entry(self, path, hexdigest):
+        stat = os.stat(path)
+        return [hexdigest, stat.st_size, stat.st_mtime]
+
+    def _commit(self, targetfile, manifest):
+        path = os.path.abspath(targetfile.abspath)
+        data = self.render(targetfile)
+        hexdigest = digest(data)
+        ondisk = self._ondisk(path, manifest.get(self._key(path)))
+        if ondisk == hexdigest:
+            return path, 'unchanged', len(data), self._entry(path, hexdigest)
+        status = ondisk is None and 'created' or 'changed'
+        if self.dryrun:
+            return path, status, len(data), None
+        self._write(path, data)
+        return path, status, len(data), self._entry(path, hexdigest)
+
+    def _write(self, path, data):
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError, e:
+                # concurrently created by another job
+                if e.errno != errno.EEXIST:
+                    raise
+        staging = self.stagingpath
+        if not path.startswith(self.basedir + os.sep):
+            # rename is only atomic on the same file system
+            staging = directory
+        elif not os.path.isdir(staging):
+            try:
+                os.makedirs(staging)
+            except OSError, e:
+                if e.errno != errno.EEXIST:
+                    raise
+        fd, tmppath = tempfile.mkstemp(dir=staging, prefix='.agx')
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                file.write(data)
+            if os.path.exists(path):
+                os.chmod(tmppath, os.stat(path).st_mode & 07777)
+            else:
+                os.chmod(tmppath, self.mode)
+            os.rename(tmppath, path)
+        except Exception:
+            if os.path.exists(tmppath):
+                os.remove(tmppath)
+            raise
+
+    def _remove(self, key, entry):
+        """Remove stale file.
+
+        @return: Size of removed file or ``None`` if not removed.
+        """
+        path = self._path(key)
+        hexdigest = self._ondisk(path, entry)
+        if hexdigest is None:
+            return None
+        if hexdigest != entry[0]:
+            log.warning("Stale file '%s' modified, not removed." % path)
+            return None
+        size = os.stat(path).st_size
+        if not self.dryrun:
+            os.remove(path)
+        return size
@@ -0,0 +1,274 @@
+import uuid as uuidmodule
+from zope.interface import implementer
+from agx.core.interfaces import ISource
+
+
+# children count from which on a name index is used for key lookups
+INDEX_THRESHOLD = 8
+
+_unicodenames = dict()
+
+
+def internname(name):
+    """Return interned name.
+
+    Source trees repeat the same names many times, i.e. names of attribute
+    types or stereotypes. ``str`` names are interned by ``intern``, unicode
+    names via a module level table.
+    """
+    if type(name) is str:
+        return intern(name)
+    if type(name) is unicode:
+        return _unicodenames.setdefault(name, name)
+    return name
+
+
+class NodeBase(object):
+    """Node API shared by node implementations not based on ``node.base``.
+
+    Subclasses provide ``__name__``, ``__parent__`` and ``_uuid``, ``uuid`` is
+    created on first access.
+    """
+    __slots__ = ()
+
+    @property
+    def name(self):
+        return self.__name__
+
+    @property
+    def parent(self):
+        return self.__parent__
+
+    @property
+    def path(self):
+        path = list()
+        node = self
+        while node is not None:
+            path.append(node.__name__)
+            node = node.__parent__
+        path.reverse()
+        return path
+
+    @property
+    def root(self):
+        node = self
+        while node.__parent__ is not None:
+            node = node.__parent__
+        return node
+
+    def _get_uuid(self):
+        if self._uuid is None:
+            self._uuid = uuidmodule.uuid4()
+        return self._uuid
+
+    def _set_uuid(self, value):
+        self._uuid = value
+
+    uuid = property(_get_uuid, _set_uuid)
+
+    def __nonzero__(self):
+        return True
+
+    def __repr__(self):
+        return "<%s object '%s' at %s>" % (self.__class__.__name__,
+                                          self.__name__,
+                                          hex(id(self))[:-1])
+
+    __str__ = __repr__
+
+
+@implementer(ISource)
+class CompactNode(NodeBase):
+    """Memory compact source node.
+
+    All state is kept in slots. Children are stored in a list in insertion
+    order, their names are read from the children themselves. A name index
+    is built lazily on the first key lookup if the node contains at least
+    ``INDEX_THRESHOLD`` children and dropped on modification. ``uuid`` and
+    ``attrs`` are created on first access.
+
+    Provides the parts of the ``INode`` API used by generators and handlers.
+    """
+    __slots__ = (
+        '__name__',
+        '__parent__',
+        '__provides__',
+        '__weakref__',
+        '_children',
+        '_index',
+        '_uuid',
+        '_attrs',
+    )
+
+    def __init__(self, name=None, parent=None):
+        self.__name__ = internname(name)
+        self.__parent__ = parent
+        self._children = None
+        self._index = None
+        self._uuid = None
+        self._attrs = None
+
+    # node API
+
+    @property
+    def attrs(self):
+        if self._attrs is None:
+            self._attrs = dict()
+        return self._attrs
+
+    def acquire(self, interface):
+        node = self.__parent__
+        while node is not None:
+            if interface.providedBy(node):
+                return node
+            node = node.__parent__
+        return None
+
+    def node(self, uuid):
+        """Return node by uuid located in this subtree or ``None``.
+        """
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            if node._uuid == uuid:
+                return node
+            if isinstance(node, CompactNode) and node._children:
+                stack.extend(node._children)
+        return None
+
+    def detach(self, key):
+        node = self[key]
+        del self[key]
+        return node
+
+    def filtereditervalues(self, interface):
+        for child in self.itervalues():
+            if interface.providedBy(child):
+                yield child
+
+    def filteredvalues(self, interface):
+        return list(self.filtereditervalues(interface))
+
+    def printtree(self, indent=0):
+        print "%s%r" % (indent * ' ', self)
+        for child in self.itervalues():
+            if isinstance(child, CompactNode):
+                child.printtree(indent + 2)
+            else:
+                print "%s%r" % ((indent + 2) * ' ', child)
+
+    # mapping API
+
+    def _position(self, key):
+        children = self._children
+        if not children:
+            return -1
+        if len(children) < INDEX_THRESHOLD:
+            for position, child in enumerate(children):
+                if child.__name__ == key:
+                    return position
+            return -1
+        if self._index is None:
+            self._index = dict([(child.__name__, position) \
+                                for position, child in enumerate(children)])
+        return self._index.get(key, -1)
+
+    def __getitem__(self, key):
+        position = self._position(key)
+        if position == -1:
+            raise KeyError(key)
+        return self._children[position]
+
+    def __setitem__(self, key, value):
+        key = internname(key)
+        value.__name__ = key
+        value.__parent__ = self
+        position = self._position(key)
+        if position != -1:
+            self._children[position] = value
+            return
+        if self._children is None:
+            self._children = list()
+        self._children.append(value)
+        if self._index is not None:
+            self._index[key] = len(self._children) - 1
+
+    def __delitem__(self, key):
+        position = self._position(key)
+        if position == -1:
+            raise KeyError(key)
+        del self._children[position]
+        self._index = None
+
+    def __contains__(self, key):
+        return self._position(key) != -1
+
+    has_key = __contains__
+
+    def __len__(self):
+        if self._children is None:
+            return 0
+        return len(self._children)
+
+    def __iter__(self):
+        return self.iterkeys()
+
+    def iterkeys(self):
+        for child in self._children or ():
+            yield child.__name__
+
+    def itervalues(self):
+        return iter(self._children or ())
+
+    def iteritems(self):
+        for child in self._children or ():
+            yield child.__name__, child
+
+    def keys(self):
+        return list(self.iterkeys())
+
+    def values(self):
+        return list(self._children or ())
+
+    def items(self):
+        return list(self.iteritems())
+
+    def get(self, key, default=None):
+        position = self._position(key)
+        if position == -1:
+            return default
+        return self._children[position]
+
+    def setdefault(self, key, default=None):
+        position = self._position(key)
+        if position == -1:
+            self[key] = default
+            return default
+        return self._children[position]
+
+    def pop(self, key, *default):
+        position = self._position(key)
+        if position == -1:
+            if default:
+                return default[0]
+            raise KeyError(key)
+        value = self._children[position]
+        del self[key]
+        return value
+
+    def popitem(self):
+        if not self._children:
+            raise KeyError(u"popitem(): node is empty")
+        value = self._children.pop()
+        self._index = None
+        return value.__name__, value
+
+    def update(self, data=(), **kw):
+        if hasattr(data, 'items'):
+            data = data.items()
+        for key, value in list(data) + kw.items():
+            self[key] = value
+
+    def clear(self):
+        self._children = None
+        self._index = None
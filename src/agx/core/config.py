@@ -1,12 +1,20 @@
 import os
+import sys
+import copy
+import pkgutil
+import traceback
+import threading
 import subprocess
 import ConfigParser
 import pkg_resources
 from StringIO import StringIO
 
+import agx.core
 from zope.interface import implementer
+from zope.component import getGlobalSiteManager
 from zope.configuration.xmlconfig import XMLConfig
 from agx.core.interfaces import IConfLoader
+from agx.core import cache
 
 
 # generators registry
@@ -14,9 +22,63 @@ generators = list()
 
 
 def register_generator(package):
+    for index, generator in enumerate(generators):
+        if generator.__name__ == package.__name__:
+            generators[index] = package
+            return
     generators.append(package)
 
 
+def load_generators():
+    """Import generator packages registered by ``GeneratorEntry``.
+    """
+    for generator in list(generators):
+        if isinstance(generator, GeneratorEntry):
+            generator.load()
+    return generators
+
+
+class GeneratorEntry(object):
+    """Generator package registered by entry point, imported on demand.
+
+    Provides ``__name__`` and ``__file__`` of the package without importing
+    it.
+    """
+
+    def __init__(self, module_name, attrs, version=None):
+        """@param module_name: Module containing the register function.
+        @param attrs: Attribute path to the register function.
+        @param version: Version of the distribution.
+        """
+        self.__name__ = module_name
+        self.attrs = attrs
+        self.version = version
+
+    @property
+    def __file__(self):
+        loader = pkgutil.get_loader(self.__name__)
+        if loader is None:
+            return None
+        return loader.get_filename()
+
+    def load(self):
+        """Import package and call its register function, which is supposed
+        to replace this entry by the package with ``register_generator``.
+        """
+        try:
+            ob = __import__(self.__name__, fromlist=['__name__'])
+            for attr in self.attrs:
+                ob = getattr(ob, attr)
+            ob()
+        except:
+            print >> sys.stderr,'Error importing generator package ', \
+                self.__name__
+            print >> sys.stderr,'===================================='
+            traceback.print_exc(None)
+        if self in generators:
+            generators.remove(self)
+
+
 @implementer(IConfLoader)
 class ConfLoader(object):
     flavour = 'Reincarnation'  # XXX: rename ``flavour`` to ``code_name``
@@ -28,9 +90,10 @@ class ConfLoader(object):
     def generators(self):
         ret = list()
         for generator in generators:
-            name = generator.__name__
-            version = pkg_resources.get_distribution(name).version
-            ret.append((generator.__name__, version))
+            if isinstance(generator, GeneratorEntry):
+                ret.append((generator.__name__, generator.version))
+                continue
+            ret.append((generator.__name__, version(generator.__name__)))
         return ret
 
     @property
@@ -39,11 +102,18 @@ class ConfLoader(object):
         for generator in generators:
             for profile in self._profiles(generator):
                 ret.append(profile)
+        self._flush()
         return ret
 
     def _profiles(self, module):
         basepath = os.path.split(module.__file__)[:-1][0]
         profilepath = os.path.join(basepath, 'profiles')
+        if self.index:
+            metadata.load()
+        profiles = metadata.get('profiles', profilepath, self._scan_profiles)
+        return [list(profile) for profile in profiles]
+
+    def _scan_profiles(self, profilepath):
         ret = list()
         if os.path.exists(profilepath) and os.path.isdir(profilepath):
             for file in os.listdir(profilepath):
@@ -52,7 +122,7 @@ class ConfLoader(object):
                         file[0:file.find('.profile.uml')],
                         os.path.join(profilepath, file),
                     ])
-        return ret
+        return [profilepath], ret
 
     def open_manifest(self, templpath, fname='manifest.txt'):
         """Parses the manifest.
@@ -91,26 +161,228 @@ class ConfLoader(object):
         for generator in generators:
             tempdict = self._templates_dict(generator)
             ret.update(tempdict)
+        self._flush()
         return ret
 
     def _templates_dict(self, module):
         basepath = os.path.split(module.__file__)[:-1][0]
         respath = os.path.join(basepath, 'resources')
+        templpath = os.path.join(respath, 'model_templates')
+        if self.index:
+            metadata.load()
+        return copy.deepcopy(
+            metadata.get('templates', templpath, self._scan_templates))
+
+    def _scan_templates(self, templpath):
         ret = {}
-        if os.path.exists(respath) and os.path.isdir(respath):
-            templpath = os.path.join(respath, 'model_templates')
-            if os.path.exists(templpath) and os.path.isdir(templpath):
-                for file in os.listdir(templpath):
-                    conf = self.open_manifest(os.path.join(templpath, file))
-                    ret[file] = {
-                        'name': file,
-                        'title': conf['title'],
-                        'files': conf['files'],
-                        'description': conf['description'],
-                        'path': os.path.join(templpath, file),
-                    }
-        return ret
+        watched = [templpath]
+        if os.path.exists(templpath) and os.path.isdir(templpath):
+            for file in os.listdir(templpath):
+                conf = self.open_manifest(os.path.join(templpath, file))
+                watched.append(os.path.join(templpath, file, 'manifest.txt'))
+                ret[file] = {
+                    'name': file,
+                    'title': conf['title'],
+                    'files': conf['files'],
+                    'description': conf['description'],
+                    'path': os.path.join(templpath, file),
+                }
+        return watched, ret
+
+    # persist profile and template metadata, see ``MetadataCache``
+    index = False
+
+    def _flush(self):
+        if self.index:
+            metadata.dump()
+
+    # use a persistent snapshot of the registrations done by the generator
+    # configurations, see ``agx.core.cache``
+    snapshot = False
+
+    def __init__(self):
+        self.loaded = set()
+        self._lock = threading.Lock()
 
     def __call__(self):
-        for generator in generators:
+        # controllers might run concurrently, load in one of them only
+        with self._lock:
+            self._load()
+
+    def _load(self):
+        load_generators()
+        # load configuration of each generator once per process
+        pending = [generator for generator in generators \
+                   if generator.__name__ not in self.loaded]
+        if not pending:
+            return
+        key = None
+        if self.snapshot:
+            key = self._snapshot_key(pending)
+            snapshot = cache.load('registry', key)
+            if snapshot is not None:
+                replay_registrations(getGlobalSiteManager(), snapshot)
+                self.loaded.update([gen.__name__ for gen in pending])
+                return
+        registry = getGlobalSiteManager()
+        before = set([reg[:-1] + (id(reg[-1]),) \
+                      for reg in registrations(registry)])
+        for generator in pending:
             XMLConfig('configure.zcml', generator)()
+            self.loaded.add(generator.__name__)
+        if self.snapshot:
+            snapshot = [reg for reg in registrations(registry) \
+                        if not reg[:-1] + (id(reg[-1]),) in before]
+            cache.dump('registry', key, snapshot)
+
+    def _snapshot_key(self, pending):
+        key = [sys.version, package_signature(agx.core)]
+        for generator in pending:
+            name = generator.__name__
+            key.append((name, version(name), package_signature(generator)))
+        return key
+
+
+def version(name):
+    """Return version of distribution by name or ``None`` if not installed.
+
+    Versions are cached per process.
+    """
+    try:
+        return _versions[name]
+    except KeyError:
+        pass
+    try:
+        ret = pkg_resources.get_distribution(name).version
+    except pkg_resources.DistributionNotFound:
+        ret = None
+    _versions[name] = ret
+    return ret
+
+
+_versions = dict()
+
+
+def mtime(path):
+    """Return modification time of path or ``None`` if it does not exist.
+    """
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+class MetadataCache(object):
+    """Cache of values computed by scanning the file system.
+
+    Each value is stored together with the modification times of the paths
+    it has been computed from. A value is recomputed as soon as one of these
+    modification times changes, i.e. if a file gets added to a scanned
+    directory or a parsed file gets edited.
+
+    The cache can be persisted in the cache directory, see ``agx.core.cache``.
+    """
+    # cache format version
+    key = 1
+
+    def __init__(self):
+        self.entries = dict()
+        self.changed = False
+        self.loaded = False
+
+    def get(self, kind, path, compute):
+        """Return value for path.
+
+        @param kind: Kind of the value.
+        @param path: Path the value is computed for.
+        @param compute: Callable getting passed path and returning a tuple
+                        ``(paths, value)``, where ``paths`` is the list of
+                        paths the value depends on.
+        """
+        entry = self.entries.get((kind, path))
+        if entry is not None:
+            watched, value = entry
+            if all([mtime(p) == t for p, t in watched]):
+                return value
+        paths, value = compute(path)
+        self.entries[(kind, path)] = ([(p, mtime(p)) for p in paths], value)
+        self.changed = True
+        return value
+
+    def load(self):
+        """Load persisted cache once. Entries already computed in this
+        process are kept.
+        """
+        if self.loaded:
+            return
+        self.loaded = True
+        entries = cache.load('metadata', self.key) or dict()
+        entries.update(self.entries)
+        self.entries = entries
+
+    def dump(self):
+        """Persist cache if changed.
+        """
+        if self.changed:
+            cache.dump('metadata', self.key, self.entries)
+            self.changed = False
+
+    def clear(self):
+        self.entries = dict()
+        self.changed = False
+        self.loaded = False
+
+
+metadata = MetadataCache()
+
+
+def package_signature(module):
+    """Return sorted list of ``(path, mtime)`` for all configuration and python
+    files contained in the directory of package.
+    """
+    basepath = os.path.dirname(module.__file__)
+    ret = list()
+    for dirpath, dirnames, filenames in os.walk(basepath):
+        for filename in filenames:
+            if filename.endswith('.zcml') or filename.endswith('.py'):
+                path = os.path.join(dirpath, filename)
+                ret.append((path, os.stat(path).st_mtime))
+    ret.sort()
+    return ret
+
+
+def registrations(registry):
+    """Return list of registrations of component registry.
+
+    Each registration is a tuple starting with the kind of registration,
+    the registered component or factory is the last item.
+    """
+    ret = list()
+    for reg in registry.registeredUtilities():
+        ret.append(('utility', reg.provided, reg.name, reg.component))
+    for reg in registry.registeredAdapters():
+        ret.append(('adapter', tuple(reg.required), reg.provided, reg.name,
+                    reg.factory))
+    for reg in registry.registeredSubscriptionAdapters():
+        ret.append(('subscriber', tuple(reg.required), reg.provided, reg.name,
+                    reg.factory))
+    for reg in registry.registeredHandlers():
+        ret.append(('handler', tuple(reg.required), reg.name, reg.factory))
+    return ret
+
+
+def replay_registrations(registry, registrations):
+    """Register registrations as returned by ``registrations`` at registry.
+    """
+    for reg in registrations:
+        kind = reg[0]
+        if kind == 'utility':
+            registry.registerUtility(reg[3], reg[1], reg[2], event=False)
+        elif kind == 'adapter':
+            registry.registerAdapter(reg[4], reg[1], reg[2], reg[3],
+                                     event=False)
+        elif kind == 'subscriber':
+            registry.registerSubscriptionAdapter(reg[4], reg[1], reg[2],
+                                                 reg[3], event=False)
+        elif kind == 'handler':
+            registry.registerHandler(reg[3], reg[1], reg[2], event=False)
@@ -0,0 +1,149 @@
+import os
+import json
+import uuid as uuidmodule
+import hashlib
+from zope.interface import providedBy
+from agx.core._api import (
+    walk,
+    POSTORDER,
+)
+from agx.core.util import (
+    uuidindex,
+    read_source_to_target_mapping,
+)
+
+
+class Fingerprints(object):
+    """Fingerprints of source subtrees for incremental regeneration.
+
+    The fingerprint of a source node is a digest over its path, uuid,
+    provided interfaces, its content and the fingerprints of its children.
+    The path is included, since the target location of a subtree depends on
+    it, so renamed or moved subtrees are regenerated.
+    Fingerprints are persisted per transform in a JSON file together with
+    the uuid of the target node a source node has been mapped to.
+
+    A source subtree is considered unchanged if its fingerprint equals the one
+    of the last run and the source node has been mapped to a target node by
+    the last run. The mappings of the last run are restored for skipped
+    subtrees.
+
+    Skipping is only valid for transforms whose target persists between runs,
+    the controller only prunes transforms with ``incremental`` set.
+    """
+
+    def __init__(self, path):
+        """@param path: File path where fingerprints are persisted.
+        """
+        self.path = path
+        self.previous = dict()
+        self.current = dict()
+        self.mapped = dict()
+        if os.path.exists(path):
+            with open(path) as file:
+                try:
+                    self.previous = json.load(file)
+                except ValueError:
+                    # corrupt fingerprints file, regenerate everything
+                    pass
+
+    def content(self, node):
+        """Return string representing the data of given node.
+
+        Subclasses might override this for source node types where relevant
+        data is not contained in ``node.attrs``.
+        """
+        attrs = getattr(node, 'attrs', None)
+        if attrs is None:
+            return ''
+        return repr(sorted(attrs.items()))
+
+    def compute(self, source):
+        """Compute fingerprints of all nodes of the source tree.
+
+        @param source: ``ISource`` implementation.
+        @return: dict containing source uuid to fingerprint mapping.
+        """
+        digests = dict()
+        for event, node in walk([source]):
+            if event != POSTORDER:
+                continue
+            uuid = getattr(node, 'uuid', None)
+            if uuid is None:
+                continue
+            digest = hashlib.sha1()
+            digest.update(type(node).__name__)
+            digest.update(repr(node.path))
+            digest.update(str(uuid))
+            for iface in providedBy(node):
+                digest.update(iface.__identifier__)
+            digest.update(self.content(node))
+            for child in node.values():
+                childuuid = str(getattr(child, 'uuid', None))
+                digest.update(digests.get(childuuid, childuuid))
+            digests[str(uuid)] = digest.hexdigest()
+        return digests
+
+    def update(self, transform, source):
+        """Compute fingerprints of source for transform.
+
+        @return: Callable which returns ``True`` for unchanged source nodes.
+                 Source to target mappings of the last run are restored for
+                 the subtrees it returns ``True`` for.
+        """
+        digests = self.current[transform] = self.compute(source)
+        previous = self.previous.get(transform, {})
+
+        def unchanged(node):
+            uuid = str(getattr(node, 'uuid', None))
+            entry = previous.get(uuid)
+            if entry is None:
+                return False
+            digest, mapped = entry
+            if not isinstance(mapped, basestring) \
+              or digests.get(uuid) != digest:
+                return False
+            self.restore(previous, node)
+            return True
+        return unchanged
+
+    def restore(self, entries, node):
+        """Restore source to target mappings of subtree from entries.
+        """
+        targets = dict()
+        for event, child in walk([node]):
+            if event == POSTORDER:
+                continue
+            mapped = entries.get(str(child.uuid), [None, None])[1]
+            if isinstance(mapped, basestring):
+                targets[child.uuid] = uuidmodule.UUID(mapped)
+        uuidindex().merge(targets)
+
+    def record(self, transform):
+        """Remember source to target mappings of transform.
+
+        Called after the transform has been processed, while the tokens of
+        the run are available.
+        """
+        digests = self.current.get(transform)
+        if digests is None:
+            return
+        self.mapped[transform] = dict([
+            (str(source), str(target)) for source, target in \
+            read_source_to_target_mapping().items() if str(source) in digests
+        ])
+
+    def save(self):
+        """Persist fingerprints computed in this run.
+        """
+        data = dict(self.previous)
+        for transform, digests in self.current.items():
+            mapped = self.mapped.get(transform, {})
+            entries = data[transform] = dict()
+            for uuid, digest in digests.items():
+                entries[uuid] = [digest, mapped.get(uuid)]
+        with open(self.path, 'w') as file:
+            json.dump(data, file)
+        self.previous = data
+        self.current = dict()
+        self.mapped = dict()
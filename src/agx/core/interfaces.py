@@ -79,6 +79,10 @@ class ITransform(Interface):
     """
 
     name = Attribute(u"Name of this transform")
+    incremental = Attribute(u"Optional flag whether the target persists "
+                            u"between runs, i.e. is read from the output "
+                            u"directory. Only then source subtrees unchanged "
+                            u"since the last run might be skipped.")
 
     def source(path):
         """Read source.
@@ -95,13 +99,40 @@ class ITransform(Interface):
         """
 
 
+class IStreamingTransform(ITransform):
+    """Transform reading the source incrementally.
+
+    Used instead of ``source`` by the controller, so streamable generators
+    start dispatching while the source is read.
+    """
+
+    def stream(path):
+        """Read source incrementally.
+
+        @param path: source path.
+        @return: Iterable. The first item is the source root, each following
+                 item is a child of the root which has been read completely
+                 including its descendants.
+        """
+
+
 class IGenerator(Interface):
     """Generator interface.
     """
 
     name = Attribute(u"The name of this generator")
-    depends = Attribute(u"generators this generator depends on")
+    depends = Attribute(u"generators this generator depends on. Either a "
+                        u"string with names separated by whitespace or comma "
+                        u"or a list of names.")
     backup = Attribute(u"Flag wether generator should create backup or not")
+    shardable = Attribute(u"Flag whether the subtrees of the children of the "
+                          u"source root might be dispatched by forked worker "
+                          u"processes.")
+    processes = Attribute(u"Number of worker processes used if shardable.")
+    streamable = Attribute(u"Flag whether the generator dispatches children "
+                           u"of a streamed source root as they are read. "
+                           u"Handlers must only depend on the subtree they "
+                           u"are called for and its ancestors.")
 
     def __call__(source, target):
         """Walk through source and invoke a dispatcher for each element.
@@ -131,6 +162,11 @@ class IScope(Interface):
 
     name = Attribute(u"Name of this scope")
     interfaces = Attribute(u"List of ``zope.interface.Interface``.")
+    require = Attribute(u"Optional list of interfaces nodes must provide "
+                        u"all of.")
+    exclude = Attribute(u"Optional list of interfaces nodes must not "
+                        u"provide.")
+    predicate = Attribute(u"Optional callable getting passed the node.")
 
     def __call__(node):
         """Check wether scope applies on node.
@@ -246,3 +282,33 @@ class ISource(INode):
 class ITarget(INode, ICallable):
     """Target Element.
     """
+
+    keysdiffer = Attribute(u"Optional class flag whether children are stored "
+                           u"by keys differing from their names. Target "
+                           u"handlers then look up children by name by "
+                           u"scanning the values.")
+
+
+class ITargetFile(Interface):
+    """A file of the target tree.
+
+    Target nodes providing or adaptable to this interface are written by
+    ``agx.core.commit.Committer`` instead of calling the target tree.
+    """
+
+    abspath = Attribute(u"Absolute file system path of the file.")
+
+    def render():
+        """Return the file content as string.
+        """
+
+
+class ILazyTarget(ITarget):
+    """Target node loaded from the file system on demand.
+
+    Nodes not loaded are skipped by ``agx.core.commit.Committer``, files
+    written by a previous commit beneath them are kept.
+    """
+
+    loaded = Attribute(u"Flag whether children respective content have been "
+                       u"read or set.")
@@ -0,0 +1,228 @@
+import os
+import errno
+from odict import odict
+from zope.interface import implementer
+from agx.core.interfaces import (
+    ILazyTarget,
+    ITargetFile,
+)
+from agx.core.compact import NodeBase
+from agx.core.commit import (
+    MANIFEST,
+    STAGING,
+)
+
+
+_unset = object()
+
+
+class _LazyNode(NodeBase):
+    """Common parts of lazy target nodes.
+    """
+
+    def __init__(self, name=None, parent=None):
+        self.__name__ = name
+        self.__parent__ = parent
+        self._uuid = None
+
+    @property
+    def abspath(self):
+        if self.__parent__ is None:
+            return os.path.abspath(self.__name__)
+        return os.path.join(self.__parent__.abspath, self.__name__)
+
+
+@implementer(ILazyTarget, ITargetFile)
+class LazyFile(_LazyNode):
+    """File of an existing output directory.
+
+    The content is read on first access of ``data``. Files neither read nor
+    written are skipped by ``agx.core.commit.Committer`` and never pruned.
+    """
+
+    def __init__(self, name=None, parent=None):
+        _LazyNode.__init__(self, name, parent)
+        self._data = None
+        self.modified = False
+
+    @property
+    def loaded(self):
+        return self._data is not None
+
+    def _get_data(self):
+        if self._data is None:
+            self._data = self.read()
+        return self._data
+
+    def _set_data(self, value):
+        self._data = value
+        self.modified = True
+
+    data = property(_get_data, _set_data)
+
+    def read(self):
+        """Return content on disk or empty string if file does not exist.
+        """
+        try:
+            with open(self.abspath, 'rb') as file:
+                return file.read()
+        except IOError, e:
+            if e.errno != errno.ENOENT:
+                raise
+            return ''
+
+    def render(self):
+        return self.data
+
+    def values(self):
+        return []
+
+    def __call__(self):
+        """Write content if modified.
+        """
+        if not self.modified:
+            return
+        data = self._data
+        if isinstance(data, unicode):
+            data = data.encode('utf-8')
+        directory = os.path.dirname(self.abspath)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(self.abspath, 'wb') as file:
+            file.write(data)
+        self.modified = False
+
+
+@implementer(ILazyTarget)
+class LazyDirectory(_LazyNode):
+    """Directory of an existing output directory.
+
+    The directory is listed on first access of its children, child nodes are
+    created on first access by name. Subdirectories are ``LazyDirectory``
+    instances, files are created by the factory registered for their
+    extension in ``factories`` of the root directory, ``LazyFile`` by
+    default. Factories are called with name and parent of the file.
+
+    Untouched subtrees are neither listed nor read and skipped by
+    ``agx.core.commit.Committer``. Deleting children does not remove them
+    from disk, ``Committer`` prunes them if they have been generated.
+    """
+
+    def __init__(self, name=None, parent=None, factories=None):
+        """@param name: Path of the directory if root, otherwise its name.
+        @param parent: Parent directory.
+        @param factories: Dict containing file extension to factory mapping.
+                          Only used on the root directory.
+        """
+        _LazyNode.__init__(self, name, parent)
+        self._factories = factories
+        self._children = None
+
+    @property
+    def loaded(self):
+        return self._children is not None
+
+    @property
+    def factories(self):
+        return self.root._factories or dict()
+
+    def _load(self):
+        if self._children is None:
+            children = odict()
+            if os.path.isdir(self.abspath):
+                for name in sorted(os.listdir(self.abspath)):
+                    if name not in (MANIFEST, STAGING):
+                        children[name] = _unset
+            self._children = children
+        return self._children
+
+    def _create(self, name):
+        if os.path.isdir(os.path.join(self.abspath, name)):
+            return LazyDirectory(name, self)
+        factory = self.factories.get(os.path.splitext(name)[1], LazyFile)
+        return factory(name, self)
+
+    def node(self, uuid):
+        """Return loaded node by uuid located in this subtree or ``None``.
+        """
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            if getattr(node, 'uuid', None) == uuid:
+                return node
+            if isinstance(node, LazyDirectory):
+                if node._children is not None:
+                    stack.extend([child for child in node._children.values() \
+                                  if child is not _unset])
+            else:
+                stack.extend(getattr(node, 'values', list)())
+        return None
+
+    # mapping API
+
+    def __getitem__(self, key):
+        children = self._load()
+        child = children[key]
+        if child is _unset:
+            child = children[key] = self._create(key)
+        return child
+
+    def __setitem__(self, key, value):
+        value.__name__ = key
+        value.__parent__ = self
+        self._load()[key] = value
+
+    def __delitem__(self, key):
+        del self._load()[key]
+
+    def __contains__(self, key):
+        return key in self._load()
+
+    has_key = __contains__
+
+    def __len__(self):
+        return len(self._load())
+
+    def __iter__(self):
+        return iter(self._load().keys())
+
+    iterkeys = __iter__
+
+    def itervalues(self):
+        for key in self._load().keys():
+            yield self[key]
+
+    def iteritems(self):
+        for key in self._load().keys():
+            yield key, self[key]
+
+    def keys(self):
+        return self._load().keys()
+
+    def values(self):
+        return list(self.itervalues())
+
+    def items(self):
+        return list(self.iteritems())
+
+    def get(self, key, default=None):
+        if key not in self._load():
+            return default
+        return self[key]
+
+    def detach(self, key):
+        node = self[key]
+        del self[key]
+        node.__parent__ = None
+        return node
+
+    def __call__(self):
+        """Write loaded children.
+        """
+        if self._children is None:
+            return
+        if not os.path.isdir(self.abspath):
+            os.makedirs(self.abspath)
+        for child in self._children.values():
+            if child is not _unset and callable(child):
+                child()
@@ -1,6 +1,11 @@
+import os
 import sys
-import traceback
 from pkg_resources import iter_entry_points
+from agx.core import cache
+from agx.core.config import (
+    GeneratorEntry,
+    register_generator,
+)
 
 
 def get_entry_points(ns=None):
@@ -12,11 +17,49 @@ def get_entry_points(ns=None):
     return entry_points
 
 
-for ep in get_entry_points('register'):
-    try:
-        ep.load()()
-    except:
-        print >> sys.stderr,'Error importing generator package ', ep.module_name
-        print >> sys.stderr,'===================================='
-        traceback.print_exc(None)
-        
+def discovery_key():
+    """Key used to validate cached entry point discovery.
+
+    Considers modification times of ``sys.path`` entries and of the entry
+    point metadata of distributions contained in them. These change when
+    distributions get installed or removed.
+    """
+    key = [sys.version]
+    for path in sys.path:
+        path = path or os.curdir
+        if not os.path.isdir(path):
+            key.append((path, os.path.exists(path) and \
+                        os.stat(path).st_mtime or None))
+            continue
+        key.append((path, os.stat(path).st_mtime))
+        for name in os.listdir(path):
+            if not name.endswith('.egg-info') \
+              and not name.endswith('.dist-info') \
+              and name != 'EGG-INFO':
+                continue
+            metadata = os.path.join(path, name, 'entry_points.txt')
+            if os.path.exists(metadata):
+                key.append((metadata, os.stat(metadata).st_mtime))
+    return key
+
+
+def discover(ns=None):
+    """Return list of ``(name, module_name, attrs, version)`` tuples for
+    ``agx.generator`` entry points.
+
+    The result of scanning the installed distributions is cached.
+    """
+    key = discovery_key()
+    entries = cache.load('entrypoints', key)
+    if entries is None:
+        entries = list()
+        for ep in get_entry_points():
+            version = ep.dist is not None and ep.dist.version or None
+            entries.append((ep.name, ep.module_name, ep.attrs, version))
+        cache.dump('entrypoints', key, entries)
+    return [entry for entry in entries if ns is None or entry[0] == ns]
+
+
+# register generator packages, they get imported on demand.
+for name, module_name, attrs, version in discover('register'):
+    register_generator(GeneratorEntry(module_name, attrs, version))
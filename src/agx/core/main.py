@@ -13,6 +13,7 @@ from StringIO import StringIO
 import agx.core
 from time import (
     time,
+    sleep,
     strftime,
     gmtime,
 )
@@ -21,6 +22,14 @@ from optparse import OptionParser
 from zope.component import getUtility
 from zope.configuration.xmlconfig import XMLConfig
 from agx.core.interfaces import IConfLoader
+from agx.core.incremental import Fingerprints
+from agx.core.profiler import Profiler
+from agx.core.commit import Committer
+from agx.core.batch import (
+    batch,
+    read_batchfile,
+    summary,
+)
 from agx.core import postmortem
 import logging
 
@@ -70,6 +79,57 @@ def parse_options():
         "-c", "--create", dest="create_model",
         help="Create a model from a model template by name. (see '-t' option)",
         metavar="template_name")
+    parser.add_option("-j", "--jobs", dest="jobs", type="int", default=1,
+                      help="Number of independent generators executed "
+                           "concurrently in threads. No parallel speedup "
+                           "for CPU bound handlers due to the GIL",
+                      metavar="N")
+    parser.add_option("-I", "--incremental",
+                      action="store_true", dest="incremental", default=False,
+                      help="Skip source subtrees unchanged since last run "
+                           "for transforms with a persistent target.")
+    parser.add_option("-w", "--watch",
+                      action="store_true", dest="watch", default=False,
+                      help="Regenerate whenever model or profiles change.")
+    parser.add_option("-r", "--registry-cache",
+                      action="store_true", dest="registry_cache",
+                      default=False,
+                      help="Replay cached generator registrations instead of "
+                           "processing ZCML if generators are unchanged, "
+                           "cache profile and template metadata on disk.")
+    parser.add_option("-f", "--profile", dest="profile", default=None,
+                      help="Profile generators and handlers, write results "
+                           "as JSON to FILE",
+                      metavar="/path/to/profile.json")
+    parser.add_option("-P", "--plan",
+                      action="store_false", dest="plan",
+                      default='unset', help="Print generator execution plan.")
+    parser.add_option("--commit",
+                      action="store_true", dest="commit", default=False,
+                      help="Only write changed files, atomically and "
+                           "concurrently. Requires file targets providing "
+                           "ITargetFile.")
+    parser.add_option("--prune",
+                      action="store_true", dest="prune", default=False,
+                      help="Remove files generated by a previous run which "
+                           "are not generated any longer. Implies --commit.")
+    parser.add_option("-n", "--dry-run",
+                      action="store_true", dest="dry_run", default=False,
+                      help="Do not write anything, report files which would "
+                           "be created, changed or deleted. Requires file "
+                           "targets providing ITargetFile.")
+    parser.add_option("-b", "--batch", dest="batch", default=None,
+                      help="Generate all models listed in FILE, one path "
+                           "per line, in one process.",
+                      metavar="/path/to/models.txt")
+    parser.add_option("--processes", dest="processes", type="int",
+                      default=1, help="Number of worker processes used in "
+                                      "batch mode.",
+                      metavar="N")
+    parser.add_option("--shards", dest="shards", type="int", default=1,
+                      help="Number of worker processes dispatching the top "
+                           "level packages for shardable generators.",
+                      metavar="N")
     parser.add_option("-s", "--short", default="unset",
                       action='store_false', dest="short_messages",
                       help="option for short machine readable messages")
@@ -133,6 +193,23 @@ def agx_info():
     print info
 
 
+def load_configuration(registry_cache=False):
+    XMLConfig('configure.zcml', agx.core)()
+    if registry_cache:
+        confloader = getUtility(IConfLoader)
+        confloader.snapshot = True
+        confloader.index = True
+
+
+def agx_plan(registry_cache=False):
+    load_configuration(registry_cache)
+    confloader = getUtility(IConfLoader)
+    confloader()
+    for name in confloader.transforms:
+        print agx.core.Processor(name).plan
+        print
+
+
 def prepare_model_path(modelpath):
     """Unifies the containing dir of model, the .agx  and the .uml filename
     if no .agx is present, None is returned.
@@ -236,6 +313,9 @@ def run():
     if options.info != 'unset':
         agx_info()
         return
+    if options.plan != 'unset':
+        agx_plan(options.registry_cache)
+        return
     if options.listtemplates != 'unset':
         avaliable_templates(options.short_messages != 'unset')
         return
@@ -252,6 +332,11 @@ def run():
         templatename = options.create_model
         create_model(targetdir, templatename, modelname)
         return
+    if options.batch:
+        load_configuration(options.registry_cache)
+        if not agx_batch(options.batch, options):
+            sys.exit(1)
+        return
     if len(args) != 1:
         log.critical("No control flags given.")
         parser.print_help()
@@ -262,8 +347,20 @@ def run():
     log.info(ARCHGENXML_VERSION_LINE, version())
     log.info('Generator started at %s.' % (
              strftime("%H:%M:%S %Y-%m-%d", gmtime())))
-    XMLConfig('configure.zcml', agx.core)()
-    modelpath = args[0]
+    load_configuration(options.registry_cache)
+    if options.watch:
+        watch(args[0], options)
+        return
+    generate(args[0], options, starttime)
+
+
+def generate(modelpath, options, starttime=None):
+    """Generate model with given options.
+
+    Returns list of paths the generation result depends on.
+    """
+    if starttime is None:
+        starttime = time()
     modelprofiles = options.profiles.strip()
     agxprofiles = []
     agxtarget = []
@@ -282,12 +379,102 @@ def run():
 #        options.outdir = localdir
 
     outdir = options.outdir or localdir
-    if not os.path.exists(outdir):
+    if not options.dry_run and not os.path.exists(outdir):
         os.makedirs(outdir)
     log.info('generating model: %s' % umlpath)
     log.info('using profiles: %s' % profilepaths)
     log.info('generating into: %s' % outdir)
     modelpaths = [umlpath] + profilepaths
-    controller = agx.core.Controller()
-    controller(modelpaths, outdir)
+    fingerprints = None
+    # fingerprints of a dry run would mark unwritten files as generated
+    if options.incremental and not options.dry_run:
+        fingerprints = Fingerprints(
+            os.path.join(localdir, umlname + '.fingerprints'))
+    committer = None
+    if options.commit or options.prune or options.dry_run:
+        committer = Committer(outdir, jobs=max(options.jobs, 4),
+                              prune=options.prune, dryrun=options.dry_run)
+    controller = agx.core.Controller(jobs=options.jobs,
+                                     fingerprints=fingerprints,
+                                     committer=committer,
+                                     processes=options.shards)
+    profiler = None
+    if options.profile:
+        # load configuration first to get all components profiled
+        getUtility(IConfLoader)()
+        profiler = Profiler()
+        profiler.install()
+    try:
+        controller(modelpaths, outdir)
+    finally:
+        if profiler is not None:
+            profiler.uninstall()
+    if committer is not None:
+        result = committer.result
+        # trees not providing ITargetFile are rejected by the committer,
+        # lazy trees contain no files if no directory has been loaded
+        if not (result.written or result.unchanged or result.removed):
+            log.warning('No files found to commit.')
+    if options.dry_run:
+        print result.report(outdir)
+    elif committer is not None:
+        log.info('%d files written, %d unchanged, %d removed.' % (
+                 len(result.written), len(result.unchanged),
+                 len(result.removed)))
+    if profiler is not None:
+        print profiler.table()
+        profiler.dump(options.profile)
+        log.info('Profile written to: %s' % options.profile)
     log.info('Generator run took %1.2f sec.' % (time() - starttime))
+    return modelpaths + [os.path.join(localdir, umlname + '.agx')]
+
+
+def agx_batch(batchfile, options):
+    """Generate all models listed in batchfile.
+
+    Returns ``True`` if all models have been generated successfully.
+    """
+    modelpaths = read_batchfile(batchfile)
+    log.info('Batch generating %d models.' % len(modelpaths))
+    results = batch(modelpaths, lambda path: generate(path, options),
+                    processes=options.processes)
+    for result in results:
+        if result.failed:
+            log.error("Generating '%s' failed:\n%s" % (result.item,
+                                                        result.error))
+    print summary(results)
+    return not [result for result in results if result.failed]
+
+
+def modification_times(paths):
+    ret = dict()
+    for path in paths:
+        if os.path.exists(path):
+            ret[path] = os.stat(path).st_mtime
+        else:
+            ret[path] = None
+    return ret
+
+
+def watch(modelpath, options, interval=1.0):
+    """Generate model and regenerate whenever the model, its ``.agx`` file or
+    one of the used profiles changes.
+
+    The component registry stays loaded, tokens are cleared between runs.
+    """
+    paths = generate(modelpath, options)
+    mtimes = modification_times(paths)
+    log.info('Watching for changes, press Ctrl-C to stop.')
+    try:
+        while True:
+            sleep(interval)
+            if modification_times(paths) == mtimes:
+                continue
+            agx.core.cleartokens()
+            try:
+                paths = generate(modelpath, options)
+            except Exception:
+                log.exception('Generator run failed.')
+            mtimes = modification_times(paths)
+    except KeyboardInterrupt:
+        pass
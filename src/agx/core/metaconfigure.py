@@ -48,13 +48,17 @@ def transformDirective(_context, name, class_):
 def registerGenerator(name, transform, depends,
                       targethandler=NullTargetHandler,
                       dispatcher=Dispatcher, class_=Generator,
-                      description=u''):
+                      description=u'', shardable=False, streamable=False):
     name = '%s.%s' % (transform, name)
     _chkregistered(IGenerator, name=name)
     _chkregistered(IDispatcher, name=name)
     _chkregistered(ITargetHandler, name=name)
     description = normalizetext(description)
     generator = class_(name, depends, description)
+    if shardable:
+        generator.shardable = True
+    if streamable:
+        generator.streamable = True
     provideUtility(generator, provides=IGenerator, name=name)
     dispatcher = dispatcher(name)
     provideUtility(dispatcher, provides=IDispatcher, name=name)
@@ -65,10 +69,15 @@ def registerGenerator(name, transform, depends,
 def generatorDirective(_context, name, transform, depends,
                        targethandler=NullTargetHandler,
                        dispatcher=Dispatcher, class_=Generator,
-                       description=u''):
+                       description=u'', shardable=False,
+                       streamable=False):
     name = '%s.%s' % (transform, name)
     description = normalizetext(description)
     generator = class_(name, depends, description)
+    if shardable:
+        generator.shardable = True
+    if streamable:
+        generator.streamable = True
     utility(_context, provides=IGenerator, component=generator, name=name)
     dispatcher = dispatcher(name)
     utility(_context, provides=IDispatcher, component=dispatcher, name=name)
@@ -77,16 +86,33 @@ def generatorDirective(_context, name, transform, depends,
             component=targethandler, name=name)
 
 
-def registerScope(name, transform, interfaces, class_=Scope):
+def _scopeoptions(require, exclude, predicate):
+    # only pass composite options if given, custom scope classes might not
+    # support them
+    kw = dict()
+    if require:
+        kw['require'] = require
+    if exclude:
+        kw['exclude'] = exclude
+    if predicate is not None:
+        kw['predicate'] = predicate
+    return kw
+
+
+def registerScope(name, transform, interfaces, class_=Scope,
+                  require=None, exclude=None, predicate=None):
     name = '%s.%s' % (transform, name)
     _chkregistered(IScope, name=name)
-    scope = class_(name, interfaces)
+    scope = class_(name, interfaces,
+                   **_scopeoptions(require, exclude, predicate))
     provideUtility(scope, provides=IScope, name=name)
 
 
-def scopeDirective(_context, name, transform, interfaces, class_=Scope):
+def scopeDirective(_context, name, transform, interfaces=None, class_=Scope,
+                   require=None, exclude=None, predicate=None):
     name = '%s.%s' % (transform, name)
-    scope = class_(name, interfaces)
+    scope = class_(name, interfaces,
+                   **_scopeoptions(require, exclude, predicate))
     utility(_context, provides=IScope, component=scope, name=name)
 
 
@@ -35,8 +35,10 @@ class IGeneratorDirective(interface.Interface):
         required=True)
 
     depends = schema.TextLine(
-        title=u"Dependency generator",
-        description=u"Generator expected to already be executed.",
+        title=u"Dependency generators",
+        description=u"Generators expected to already be executed. Multiple "
+                    u"generator names are separated by whitespace or comma. "
+                    u"'NO' if generator has no dependencies.",
         required=True)
 
     targethandler = fields.GlobalObject(
@@ -59,6 +61,18 @@ class IGeneratorDirective(interface.Interface):
         description=u"Inserted to Sphinx documentation if set.",
         required=False)
 
+    shardable = schema.Bool(
+        title=u"Shardable",
+        description=u"Flag whether children of the source root might be "
+                    u"dispatched by worker processes.",
+        required=False)
+
+    streamable = schema.Bool(
+        title=u"Streamable",
+        description=u"Flag whether children of the source root might be "
+                    u"dispatched while the source is read.",
+        required=False)
+
 
 class IScopeDirective(interface.Interface):
     """Directive for scopes.
@@ -76,10 +90,29 @@ class IScopeDirective(interface.Interface):
 
     interfaces = fields.Tokens(
         title=u"Interfaces",
-        description=u"``zope.interface.Interface``",
-        required=True,
+        description=u"``zope.interface.Interface``. Nodes must provide any "
+                    u"of them. Might be omitted if ``require`` is given.",
+        required=False,
+        value_type=fields.GlobalInterface())
+
+    require = fields.Tokens(
+        title=u"Required interfaces",
+        description=u"Nodes must provide all of these interfaces.",
+        required=False,
+        value_type=fields.GlobalInterface())
+
+    exclude = fields.Tokens(
+        title=u"Excluded interfaces",
+        description=u"Nodes must not provide any of these interfaces.",
+        required=False,
         value_type=fields.GlobalInterface())
 
+    predicate = fields.GlobalObject(
+        title=u"Predicate",
+        description=u"Callable getting passed the node, checked after the "
+                    u"interfaces.",
+        required=False)
+
     class_ = fields.GlobalObject(
         title=u"Scope implementation",
         description=u"``agx.core.interfaces.IScope`` implementation",
@@ -0,0 +1,101 @@
+import re
+import heapq
+
+
+NODEPENDENCY = 'NO'
+
+
+def dependencies(generator):
+    """Return names of generators the given generator depends on.
+
+    ``generator.depends`` is either a string containing one or more
+    generator names separated by whitespace or comma, or a list of names.
+    ``'NO'`` denotes no dependency.
+    """
+    depends = generator.depends
+    if isinstance(depends, basestring):
+        depends = re.split(r'[\s,]+', depends.strip())
+    return tuple([name for name in depends \
+                  if name and name != NODEPENDENCY])
+
+
+class Plan(object):
+    """Execution plan for the generators of a transform.
+
+    Generators are sorted topologically by their dependencies. Generators
+    which are not ordered by their dependencies are sorted by name.
+    """
+
+    def __init__(self, transform, generators):
+        """@param transform: The transform name.
+        @param generators: ``IGenerator`` implementations of the transform.
+        """
+        self.transform = transform
+        self.depends = dict()
+        self.levels = dict()
+        lookup = dict()
+        for generator in generators:
+            lookup[generator.name] = generator
+        for generator in generators:
+            depends = list()
+            for name in dependencies(generator):
+                depname = '%s.%s' % (transform, name)
+                if not depname in lookup:
+                    msg = u"Generator '%s' depends on unknown generator '%s'."
+                    raise ValueError(msg % (generator.name, name))
+                depends.append(depname)
+            self.depends[generator.name] = tuple(depends)
+        self.generators = [lookup[name] for name in self._sort()]
+
+    def _sort(self):
+        dependents = dict([(name, list()) for name in self.depends])
+        missing = dict()
+        for name, depends in self.depends.items():
+            missing[name] = len(depends)
+            for depname in depends:
+                dependents[depname].append(name)
+        ready = [name for name, count in missing.items() if not count]
+        heapq.heapify(ready)
+        ordered = list()
+        while ready:
+            name = heapq.heappop(ready)
+            ordered.append(name)
+            level = 0
+            for depname in self.depends[name]:
+                level = max(level, self.levels[depname] + 1)
+            self.levels[name] = level
+            for dependent in dependents[name]:
+                missing[dependent] -= 1
+                if not missing[dependent]:
+                    heapq.heappush(ready, dependent)
+        if len(ordered) != len(self.depends):
+            cyclic = sorted([name for name, count in missing.items() if count])
+            msg = u"Cyclic generator dependencies: %s."
+            raise ValueError(msg % u', '.join(cyclic))
+        return ordered
+
+    def requires(self, name, other):
+        """Check whether generator ``name`` depends directly or indirectly on
+        generator ``other``.
+        """
+        stack = list(self.depends[name])
+        seen = set()
+        while stack:
+            depname = stack.pop()
+            if depname == other:
+                return True
+            if depname in seen:
+                continue
+            seen.add(depname)
+            stack.extend(self.depends[depname])
+        return False
+
+    def __str__(self):
+        lines = [self.transform]
+        for generator in self.generators:
+            line = '    %d  %s' % (self.levels[generator.name], generator.name)
+            depends = self.depends[generator.name]
+            if depends:
+                line += ' <- %s' % ', '.join(depends)
+            lines.append(line)
+        return '\n'.join(lines)
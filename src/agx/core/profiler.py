@@ -0,0 +1,128 @@
+import json
+import threading
+from timeit import default_timer
+from zope.component import getUtilitiesFor
+from agx.core.interfaces import (
+    IGenerator,
+    IDispatcher,
+    IHandler,
+)
+from agx.core._api import Processor
+
+
+_missing = object()
+
+
+class Profiler(object):
+    """Profiler for processors, generators, dispatchers and handlers.
+
+    ``install`` wraps ``__call__`` of ``Processor`` and of the classes of all
+    registered generators, dispatchers and handlers. Call counts, cumulative
+    and self time are recorded per component. ``uninstall`` restores the
+    original classes, there is no overhead if the profiler is not installed.
+    """
+
+    def __init__(self):
+        self.stats = dict()
+        self._patched = dict()
+        self._originals = dict()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def install(self):
+        self._wrap(Processor, 'processor')
+        for iface, kind in [(IGenerator, 'generator'),
+                            (IDispatcher, 'dispatcher'),
+                            (IHandler, 'handler')]:
+            for name, util in getUtilitiesFor(iface):
+                self._wrap(type(util), kind)
+
+    def uninstall(self):
+        for cls, original in self._patched.items():
+            if original is _missing:
+                del cls.__call__
+            else:
+                cls.__call__ = original
+        self._patched = dict()
+        self._originals = dict()
+
+    def _wrap(self, cls, kind):
+        if cls in self._patched:
+            return
+        original = cls.__dict__.get('__call__', _missing)
+        func = cls.__call__.im_func
+        # unwrap if inherited from an already wrapped class
+        func = self._originals.get(func, func)
+        profiler = self
+
+        def __call__(instance, *args, **kw):
+            return profiler._call(kind, instance, func, args, kw)
+        self._originals[__call__] = func
+        self._patched[cls] = original
+        cls.__call__ = __call__
+
+    def _call(self, kind, instance, func, args, kw):
+        if kind == 'processor':
+            key = (kind, instance.transform)
+        else:
+            key = (kind, instance.name)
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = list()
+        if stack and stack[-1][0] == key:
+            # overwritten ``__call__`` calling the one of its base class
+            return func(instance, *args, **kw)
+        frame = [key, 0.0]
+        stack.append(frame)
+        start = default_timer()
+        try:
+            return func(instance, *args, **kw)
+        finally:
+            elapsed = default_timer() - start
+            stack.pop()
+            if stack:
+                stack[-1][1] += elapsed
+            with self._lock:
+                entry = self.stats.setdefault(key, [0, 0.0, 0.0])
+                entry[0] += 1
+                entry[1] += elapsed
+                entry[2] += elapsed - frame[1]
+
+    def results(self):
+        """Return list of dicts sorted by self time.
+
+        Entries for generators contain the number of visited nodes, which
+        is the number of calls of the related dispatcher.
+        """
+        ret = list()
+        for (kind, name), (calls, cumulative, own) in self.stats.items():
+            entry = {
+                'kind': kind,
+                'name': name,
+                'calls': calls,
+                'cumulative': cumulative,
+                'self': own,
+            }
+            if kind == 'generator':
+                dispatcher = self.stats.get(('dispatcher', name), [0])
+                entry['nodes'] = dispatcher[0]
+            ret.append(entry)
+        ret.sort(key=lambda x: (-x['self'], x['kind'], x['name']))
+        return ret
+
+    def table(self):
+        """Return results as text table.
+        """
+        lines = ['%-10s %-50s %8s %8s %10s %10s' % (
+            'kind', 'name', 'calls', 'nodes', 'cumulative', 'self')]
+        for entry in self.results():
+            lines.append('%-10s %-50s %8d %8s %10.4f %10.4f' % (
+                entry['kind'], entry['name'], entry['calls'],
+                entry.get('nodes', ''), entry['cumulative'], entry['self']))
+        return '\n'.join(lines)
+
+    def dump(self, path):
+        """Write results as JSON to path.
+        """
+        with open(path, 'w') as file:
+            json.dump(self.results(), file, indent=2)
@@ -0,0 +1,280 @@
+import traceback
+import itertools
+import multiprocessing
+from numbers import Number
+from agx.core.interfaces import ILazyTarget
+
+
+# function and items of running ``forkmap`` calls by call number, inherited
+# by forked workers. calls might run concurrently in several threads.
+_forked = dict()
+_calls = itertools.count()
+
+
+def _call(task):
+    number, index = task
+    func, items = _forked[number]
+    try:
+        return func(items[index]), None
+    except Exception:
+        return None, traceback.format_exc()
+
+
+def forkmap(func, items, processes, fresh=True):
+    """Call func for each item in worker processes.
+
+    Workers are forked, so func and items are inherited and need not be
+    picklable. Return values must be picklable. Might be called concurrently
+    by several threads.
+
+    @param func: Callable getting passed an item.
+    @param items: List of items.
+    @param processes: Number of worker processes.
+    @param fresh: Flag whether each item is processed by a freshly forked
+                  worker, so it sees the state of the process at the time of
+                  the call, not changes made for other items.
+    @return: List of ``(result, error)`` tuples in order of items. ``error``
+             is the formatted traceback if func failed, otherwise ``None``.
+    """
+    items = list(items)
+    number = _calls.next()
+    # registered before the pool forks and removed after all its workers
+    # exited, workers of other calls forked meanwhile just inherit it
+    _forked[number] = (func, items)
+    try:
+        pool = multiprocessing.Pool(max(min(processes, len(items)), 1),
+                                    maxtasksperchild=fresh and 1 or None)
+        try:
+            return pool.map(_call, [(number, index) \
+                                    for index in range(len(items))],
+                            chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    finally:
+        del _forked[number]
+
+
+###############################################################################
+# target trees
+###############################################################################
+
+
+def _children(node):
+    # lazy nodes not loaded have no children created in memory
+    if ILazyTarget.providedBy(node) and not node.loaded:
+        return None
+    return getattr(node, 'items', None)
+
+
+def nodeids(root):
+    """Return ids of the loaded nodes of a target tree.
+
+    Forked workers inherit the ids, nodes not contained are created by the
+    worker. ``ILazyTarget`` nodes not loaded are not traversed.
+    """
+    ids = set()
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        ids.add(id(node))
+        items = _children(node)
+        if items is not None:
+            stack.extend([child for key, child in items()])
+    return ids
+
+
+def newsubtrees(root, ids):
+    """Detach and return subtrees created since ids were computed.
+
+    @param root: Target tree.
+    @param ids: Result of ``nodeids`` called before.
+    @return: List of ``(parentpath, key, node)`` tuples in tree order.
+    """
+    found = list()
+    stack = [root]
+    while stack:
+        node = stack.pop(0)
+        items = _children(node)
+        if items is None:
+            continue
+        for key, child in items():
+            if id(child) in ids:
+                stack.append(child)
+            else:
+                found.append((node, key))
+    # do not pickle the parent tree along with the subtree
+    return [(parent.path, key, _detach(parent, key)) \
+            for parent, key in found]
+
+
+def _detach(parent, key):
+    detach = getattr(parent, 'detach', None)
+    if detach is not None:
+        return detach(key)
+    node = parent[key]
+    del parent[key]
+    node.__parent__ = None
+    return node
+
+
+def graft(parent, key, node):
+    """Add subtree created by a worker to target tree.
+
+    If parent already contains a node by key, i.e. created by another
+    worker, the children of node are grafted to the existing node.
+
+    @return: List of added nodes.
+    """
+    existing = parent.get(key)
+    if existing is None:
+        parent[key] = node
+        return [node]
+    ret = list()
+    for childkey in list(node.keys()):
+        ret += graft(existing, childkey, _detach(node, childkey))
+    return ret
+
+
+###############################################################################
+# tokens
+###############################################################################
+
+
+def snapshot(tokens):
+    """Return snapshot of token attributes for computing deltas.
+
+    Containers are copied, including containers nested in them, all other
+    values are kept by reference.
+
+    @param tokens: List of ``(name, token)`` tuples.
+    """
+    ret = dict()
+    for name, tok in tokens:
+        attrs = dict()
+        for key, value in tok.__dict__.items():
+            attrs[key] = (value, _copy(value), _nested(value))
+        ret[name] = attrs
+    return ret
+
+
+def _copy(value):
+    if isinstance(value, list):
+        return list(value)
+    if isinstance(value, dict):
+        return dict(value)
+    if isinstance(value, set):
+        return set(value)
+    return None
+
+
+def _values(value):
+    if isinstance(value, dict):
+        return value.values()
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return list(value)
+    return []
+
+
+def _nested(value):
+    """Return ``(container, copy)`` tuples of the containers nested in value.
+    """
+    ret = list()
+    seen = set()
+    stack = _values(value)
+    while stack:
+        item = stack.pop()
+        if id(item) in seen:
+            continue
+        seen.add(id(item))
+        copied = _copy(item)
+        if copied is not None:
+            ret.append((item, copied))
+        stack.extend(_values(item))
+    return ret
+
+
+def _changed(value, copied):
+    if len(value) != len(copied):
+        return True
+    if isinstance(value, dict):
+        for key, item in value.items():
+            if key not in copied or copied[key] is not item:
+                return True
+        return False
+    if isinstance(value, list):
+        for item, other in zip(value, copied):
+            if item is not other:
+                return True
+        return False
+    return value != copied
+
+
+def delta(tokens, base, exclude=()):
+    """Return changes of tokens since base snapshot was taken.
+
+    Numbers are reported as difference, lists by appended items, dicts by
+    added or replaced items and sets by added items. Other changed values
+    are replaced. Containers nested in containers can not be merged, i.e. a
+    list contained in a dict, ``ValueError`` is raised if they changed.
+
+    @param tokens: List of ``(name, token)`` tuples.
+    @param base: Result of ``snapshot``.
+    @param exclude: Names of tokens to skip.
+    @return: List of ``(name, key, operation, value)`` tuples.
+    """
+    ret = list()
+    for name, tok in sorted(tokens):
+        if name in exclude:
+            continue
+        attrs = base.get(name, {})
+        for key, value in sorted(tok.__dict__.items()):
+            if key not in attrs:
+                ret.append((name, key, 'set', value))
+                continue
+            original, copied, nested = attrs[key]
+            if value is original:
+                for container, copy in nested:
+                    if _changed(container, copy):
+                        raise ValueError(
+                            u"Container nested in attribute '%s' of token "
+                            u"'%s' changed, can not be merged." % (key, name))
+                if isinstance(value, list):
+                    if len(value) > len(copied):
+                        ret.append((name, key, 'extend',
+                                    value[len(copied):]))
+                elif isinstance(value, dict):
+                    items = dict([(k, v) for k, v in value.items() \
+                                  if k not in copied or copied[k] is not v])
+                    if items:
+                        ret.append((name, key, 'update', items))
+                elif isinstance(value, set):
+                    if value - copied:
+                        ret.append((name, key, 'union', value - copied))
+                continue
+            if isinstance(value, Number) and isinstance(original, Number) \
+              and not isinstance(value, bool):
+                ret.append((name, key, 'add', value - original))
+            else:
+                ret.append((name, key, 'set', value))
+    return ret
+
+
+def merge(changes, lookup):
+    """Apply token changes computed by ``delta``.
+
+    @param changes: Result of ``delta``.
+    @param lookup: Callable getting passed a token name, returns the token.
+    """
+    for name, key, operation, value in changes:
+        tok = lookup(name)
+        if operation == 'set' or not hasattr(tok, key):
+            setattr(tok, key, value)
+        elif operation == 'add':
+            setattr(tok, key, getattr(tok, key) + value)
+        elif operation == 'extend':
+            getattr(tok, key).extend(value)
+        elif operation == 'update':
+            getattr(tok, key).update(value)
+        elif operation == 'union':
+            getattr(tok, key).update(value)
@@ -0,0 +1,92 @@
+import sys
+import Queue
+import threading
+
+
+_end = object()
+_unset = object()
+
+
+class SourceStream(object):
+    """Source tree read by a producer thread.
+
+    Wraps the iterable returned by ``IStreamingTransform.stream``. Its first
+    item is the source root, the following items are completely read
+    children of the root. Items are read ahead into a bounded queue, so
+    reading the source overlaps with dispatching it.
+    """
+
+    def __init__(self, items, maxsize=16):
+        """@param items: Iterable returned by ``IStreamingTransform.stream``.
+        @param maxsize: Maximum number of subtrees read ahead.
+        """
+        self.queue = Queue.Queue(maxsize)
+        self.closed = False
+        self.done = False
+        self._root = _unset
+        self.thread = threading.Thread(target=self._produce, args=(items,),
+                                       name='SourceStream')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _produce(self, items):
+        try:
+            for item in items:
+                if not self._put((item, None)):
+                    return
+        except Exception:
+            self._put((None, sys.exc_info()))
+            return
+        self._put((_end, None))
+
+    def _put(self, entry):
+        while not self.closed:
+            try:
+                self.queue.put(entry, timeout=0.1)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+    def _next(self):
+        item, exc_info = self.queue.get()
+        if exc_info is not None:
+            self.done = True
+            raise exc_info[0], exc_info[1], exc_info[2]
+        if item is _end:
+            self.done = True
+        return item
+
+    @property
+    def root(self):
+        """Source root, blocks until read.
+        """
+        if self._root is _unset:
+            root = self._next()
+            if root is _end:
+                raise ValueError(u"Source stream is empty.")
+            self._root = root
+        return self._root
+
+    def __iter__(self):
+        """Iterate children of the root as they are read.
+        """
+        self.root
+        while not self.done:
+            item = self._next()
+            if item is _end:
+                return
+            yield item
+
+    def materialize(self):
+        """Read the remaining source and return the root.
+        """
+        for subtree in self:
+            pass
+        return self.root
+
+    def close(self):
+        """Stop the producer thread, i.e. if dispatching failed.
+        """
+        self.closed = True
+        self.thread.join()
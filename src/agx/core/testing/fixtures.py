@@ -0,0 +1,217 @@
+import random
+from zope.interface import (
+    Interface,
+    implementer,
+    alsoProvides,
+)
+from zope.component import (
+    getSiteManager,
+    getUtility,
+    queryUtility,
+    provideUtility,
+)
+from agx.core.interfaces import (
+    IConfLoader,
+    ITarget,
+    ITransform,
+    IGenerator,
+    IDispatcher,
+    ITargetHandler,
+    IScope,
+    IHandler,
+)
+from agx.core import (
+    registerTransform,
+    registerGenerator,
+    registerScope,
+    handler,
+    token,
+    NullTargetHandler,
+)
+from agx.core.testing.mock import (
+    Node,
+    SourceMock,
+)
+
+
+###############################################################################
+# Synthetic models
+###############################################################################
+
+
+class IPackage(Interface):
+    """Marker for package nodes.
+    """
+
+
+class IClass(Interface):
+    """Marker for class nodes.
+    """
+
+
+class IInterface(Interface):
+    """Marker for interface nodes.
+    """
+
+
+class IAttribute(Interface):
+    """Marker for attribute nodes.
+    """
+
+
+class IOperation(Interface):
+    """Marker for operation nodes.
+    """
+
+
+# default interface mix as list of ``(interface, weight)``
+INTERFACES = [
+    (IPackage, 1),
+    (IClass, 3),
+    (IInterface, 1),
+    (IAttribute, 6),
+    (IOperation, 4),
+]
+
+
+@implementer(ITarget)
+class TargetNode(Node):
+    """Target node which does not write anything.
+    """
+
+    def __call__(self):
+        pass
+
+
+def model(size, depth=4, fanout=10, interfaces=INTERFACES, seed=0,
+          factory=SourceMock):
+    """Create a synthetic model tree.
+
+    The tree is filled breadth first until it contains ``size`` nodes or
+    ``depth`` is reached. Each node but the root provides one interface
+    chosen from ``interfaces`` by weight.
+
+    @param size: Maximum number of nodes.
+    @param depth: Maximum depth of the tree, root is depth 0.
+    @param fanout: Number of children per node.
+    @param interfaces: List of ``(interface, weight)`` tuples.
+    @param seed: Seed for choosing interfaces.
+    @param factory: Node factory.
+    """
+    rand = random.Random(seed)
+    choices = list()
+    for iface, weight in interfaces:
+        choices += [iface] * weight
+    root = factory('root')
+    count = 1
+    level = [root]
+    for i in range(depth):
+        children = list()
+        for parent in level:
+            for j in range(fanout):
+                if count >= size:
+                    return root
+                child = factory()
+                if choices:
+                    alsoProvides(child, rand.choice(choices))
+                parent['n%d' % j] = child
+                children.append(parent['n%d' % j])
+                count += 1
+        level = children
+    return root
+
+
+###############################################################################
+# Synthetic registries
+###############################################################################
+
+
+@implementer(ITransform)
+class TransformFixture(object):
+    """Transform returning the trees set on it.
+    """
+    source_tree = None
+    target_tree = None
+
+    def __init__(self, name):
+        self.name = name
+
+    def source(self, path):
+        return self.source_tree
+
+    def target(self, path):
+        return self.target_tree
+
+
+@implementer(IConfLoader)
+class LoaderFixture(object):
+    flavour = 'fixture'
+    profiles = list()
+    generators = list()
+
+    def __init__(self, transforms, previous=None):
+        """@param transforms: List of transform names.
+        @param previous: Conf loader restored by ``unregister``.
+        """
+        self.transforms = transforms
+        self.previous = previous
+
+    def __call__(self):
+        pass
+
+
+def register(transform, generators=10, handlers=20, interfaces=INTERFACES):
+    """Register a transform with generators, scopes and handlers.
+
+    Generators depend on each other in a chain. For each interface a scope is
+    registered, handlers of a generator are bound to these scopes in turn.
+    Handlers increment a counter in a token named by the transform. The
+    registrations are global, remove them by ``unregister``.
+
+    @param transform: Name of the transform.
+    @param generators: Number of generators.
+    @param handlers: Number of handlers per generator.
+    @param interfaces: List of ``(interface, weight)`` tuples.
+    @return: The registered ``TransformFixture`` instance.
+    """
+    registerTransform(transform, TransformFixture)
+    scopes = list()
+    for iface, weight in interfaces:
+        registerScope(iface.__name__, transform, [iface])
+        scopes.append(iface.__name__)
+    depends = 'NO'
+    for i in range(generators):
+        generator = 'generator%d' % i
+        registerGenerator(generator, transform, depends,
+                          targethandler=NullTargetHandler)
+        depends = generator
+        for j in range(handlers):
+            scope = scopes and scopes[j % len(scopes)] or None
+            handler('handler%d' % j, transform, generator, scope, j)(count)
+    loader = LoaderFixture([transform], previous=queryUtility(IConfLoader))
+    provideUtility(loader, provides=IConfLoader)
+    return getUtility(ITransform, name=transform)
+
+
+def unregister(transform):
+    """Remove registrations made by ``register`` and restore the conf loader
+    active before.
+
+    @param transform: Name of the transform.
+    """
+    sm = getSiteManager()
+    for iface in [ITransform, IGenerator, IDispatcher, ITargetHandler, IScope,
+                  IHandler]:
+        for name, component in list(sm.getUtilitiesFor(iface)):
+            if name == transform or name.startswith(transform + '.'):
+                sm.unregisterUtility(provided=iface, name=name)
+    loader = queryUtility(IConfLoader)
+    if isinstance(loader, LoaderFixture) and transform in loader.transforms:
+        sm.unregisterUtility(provided=IConfLoader)
+        if loader.previous is not None:
+            provideUtility(loader.previous, provides=IConfLoader)
+
+
+def count(self, source, target):
+    tok = token(self.name[:self.name.find('.')], True, count=0)
+    tok.count += 1
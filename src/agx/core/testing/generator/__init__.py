@@ -0,0 +1,7 @@
+# Generator package used for testing ``agx.core.config``
+
+
+def register():
+    import agx.core.testing.generator
+    from agx.core.config import register_generator
+    register_generator(agx.core.testing.generator)
@@ -16,6 +16,16 @@ TESTFILES = [
     'config.rst',
     'test_metaconfigure.zcml',
     '_api.rst',
+    'planner.rst',
+    'incremental.rst',
+    'profiler.rst',
+    'benchmark.rst',
+    'commit.rst',
+    'compact.rst',
+    'batch.rst',
+    'shard.rst',
+    'stream.rst',
+    'lazy.rst',
 ]
 
 
@@ -1,3 +1,5 @@
+import threading
+import weakref
 import agx.core
 
 
@@ -9,17 +11,161 @@ def readsourcepath(elem):
     return getattr(elem, '_AGX_Target_sourcepath', [])
 
 
+class UUIDIndex(object):
+    """Bidirectional index between source and target nodes.
+
+    Maps source uuids to target uuids and vice versa. Target nodes are
+    referenced weakly by their uuid, so they can be returned without searching
+    the target tree and the index does not keep removed target nodes alive.
+    """
+
+    def __init__(self, targets=None):
+        """@param targets: Optional dict containing existing source uuid to
+                           target uuid mapping.
+        """
+        self.targets = targets if targets is not None else dict()
+        self.sources = dict([(v, k) for k, v in self.targets.items()])
+        self.nodes = weakref.WeakValueDictionary()
+
+    def add(self, source, target):
+        """Map source node to target node.
+        """
+        previous = self.targets.get(source.uuid)
+        if previous is not None and previous != target.uuid:
+            self.sources.pop(previous, None)
+        self.targets[source.uuid] = target.uuid
+        self.sources[target.uuid] = source.uuid
+        self.nodes[target.uuid] = target
+
+    def update(self, pairs):
+        """Map many nodes at once.
+
+        @param pairs: Iterable of ``(source, target)`` tuples.
+        """
+        for source, target in pairs:
+            self.add(source, target)
+
+    def merge(self, targets):
+        """Add mapping of source uuids to target uuids, i.e. computed by
+        another process.
+        """
+        for source_uuid, target_uuid in targets.items():
+            previous = self.targets.get(source_uuid)
+            if previous is not None and previous != target_uuid:
+                self.sources.pop(previous, None)
+            self.targets[source_uuid] = target_uuid
+            self.sources[target_uuid] = source_uuid
+
+    def discard(self, target):
+        """Remove mapping of target node.
+        """
+        source_uuid = self.sources.pop(target.uuid, None)
+        if source_uuid is not None \
+          and self.targets.get(source_uuid) == target.uuid:
+            del self.targets[source_uuid]
+        self.nodes.pop(target.uuid, None)
+
+    def target_uuid(self, source_uuid):
+        return self.targets.get(source_uuid)
+
+    def source_uuid(self, target_uuid):
+        return self.sources.get(target_uuid)
+
+    def node(self, source_uuid, root=None):
+        """Return target node mapped to source uuid.
+
+        @param source_uuid: uuid of the source node.
+        @param root: Target tree or subtree. If given, only nodes contained
+                     in it are returned. It is searched if the node is not
+                     referenced by the index any longer or has been detached
+                     or replaced.
+        @return: Target node or ``None``.
+        """
+        target_uuid = self.targets.get(source_uuid)
+        if target_uuid is None:
+            return None
+        node = self.nodes.get(target_uuid)
+        if root is None:
+            return node
+        if node is not None and contained(node, root):
+            return node
+        # uuid indices may be shared by the whole tree, check again
+        node = root.node(target_uuid)
+        if node is None or not contained(node, root):
+            return None
+        self.nodes[target_uuid] = node
+        return node
+
+
+def contained(node, root):
+    """Return whether node is contained in the tree below root.
+
+    Each parent is checked to still contain the node, so detached or replaced
+    nodes are not considered contained. O(depth).
+    """
+    while node is not root:
+        parent = node.__parent__
+        if parent is None:
+            return False
+        try:
+            child = parent[node.__name__]
+        except (KeyError, TypeError):
+            child = None
+        if child is not node:
+            # containers where keys differ from child names
+            if not getattr(parent, 'keysdiffer', False) \
+              or not [x for x in parent.values() if x is node]:
+                return False
+        node = parent
+    return True
+
+
+UUIDMAPPING = 'sourcetotargetuuidmapping'
+
+_uuidindexlock = threading.Lock()
+
+
+def uuidindex(create=True):
+    """Return the ``UUIDIndex`` of the current run.
+
+    @param create: If ``False``, raise ``ComponentLookupError`` if nothing
+                   has been mapped yet.
+    """
+    tok = agx.core.token(UUIDMAPPING, create, uuids={})
+    index = getattr(tok, 'index', None)
+    if index is None:
+        with _uuidindexlock:
+            index = getattr(tok, 'index', None)
+            if index is None:
+                # ``uuids`` is kept as alias of the forward mapping
+                index = tok.index = UUIDIndex(tok.uuids)
+    return index
+
+
 def write_source_to_target_mapping(source, target):
-    tok = agx.core.token('sourcetotargetuuidmapping', True, uuids={})
-    tok.uuids[source.uuid] = target.uuid
+    uuidindex().add(source, target)
+
+
+def read_source_to_target_mapping():
+    """Return dict containing source uuid to target uuid mapping.
+    """
+    return uuidindex().targets
 
 
 def read_target_node(source, target):
-    tok = agx.core.token('sourcetotargetuuidmapping', False)
-    target_uuid = tok.uuids.get(source.uuid)
-    if not target_uuid:
-        return None
-    return target.node(target_uuid)
+    """Return target node mapped to source node.
+
+    @param source: Source node.
+    @param target: Target tree searched if node is not indexed.
+    @return: Target node or ``None``.
+    """
+    return uuidindex(False).node(source.uuid, target)
+
+
+def read_source_uuid(target):
+    """Return uuid of source node mapped to target node or ``None``.
+    """
+    return uuidindex().source_uuid(target.uuid)
 
 
 def normalizetext(text):